@@ -2,55 +2,72 @@ import logging
 
 from src.construct_portefeuille import construct_portefeuille
 from src.rapidapi_data import *
-from src.write_output import write_portefeuille, write_dividend_overview, write_costs_overview, write_returns_overview
-from src.degiro_exports import update_exports_degiro
+from src.write_output import write_portefeuille, write_dividend_overview, write_costs_overview, write_returns_overview, \
+    add_formats, prune_plot_cache
+from src.degiro_exports import update_exports_degiro, backfill_exports_degiro
 from src.copy_excel_to_gsheet import copy_to_gsheet
-from src.benchmarks import load_benchmarks
+from src.benchmarks import load_benchmarks, BenchmarkSimulation
 #from portefeuille_dict import stock_input
+from settings import excel_constant_memory, excel_native_charts
 from dotenv import load_dotenv
 load_dotenv()
 
 
-def main(output_path='results', use_rapid_api=False):
+def main(output_path='results', use_rapid_api=False, constant_memory=excel_constant_memory,
+         native_charts=excel_native_charts, backfill=False):
     logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
     logging.info('Start program')
     update_exports_degiro()
+    if backfill:
+        # download the exports of the months that are missing
+        backfill_exports_degiro()
 
     logging.info('Constructing portfolio from exports')
     portefeuille_dict, totals_dict, winstverlies_dict, deposits = construct_portefeuille()
 
     excel_output = os.path.join(output_path, 'portefeuille.xlsx')
-    writer = pd.ExcelWriter(excel_output, engine='xlsxwriter')
+    # with constant_memory every row is flushed to disk once the next row is written, so all sheets are written top-down.
+    writer = pd.ExcelWriter(
+        excel_output, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': constant_memory}}
+    )
     wb = writer.book
+    formats = add_formats(wb)  # the cell formats are shared by all sheets
 
-    # load benchmark
+    # load benchmark, the deposits are invested in the benchmarks once for all sheets
     benchmark = load_benchmarks()
+    simulation = BenchmarkSimulation(deposits, benchmark)
 
     # add portefeuille overview per year
     for key in sorted(portefeuille_dict.keys(), reverse=True):
         wb.add_worksheet(key)  # newer years first
     logging.info('Writing portfolio overview to Excel')
     writer, totals_waarde_full = write_portefeuille(
-        portefeuille_dict, totals_dict, winstverlies_dict, deposits, benchmark, wb, writer
+        portefeuille_dict, totals_dict, winstverlies_dict, simulation, wb, formats, writer, native_charts
     )
 
     if use_rapid_api:
         # create stock overview
         logging.info('Retrieve current portfolio holdings fundamentals')
-        writer = create_stock_overview(writer, stock_input, portefeuille_dict)
+        writer = create_stock_overview(writer, formats, stock_input, portefeuille_dict)
 
     # add dividend overview
     logging.info('Writing dividend overview to Excel')
-    writer = write_dividend_overview(writer, wb)
+    writer = write_dividend_overview(writer, wb, formats, native_charts)
 
     # add costs overview
     logging.info('Writing costs overview to Excel')
-    writer = write_costs_overview(writer, wb)
+    writer = write_costs_overview(writer, wb, formats)
 
     # add yearly returns overview
     logging.info('Writing yearly returns overview to Excel')
-    writer = write_returns_overview(totals_dict, totals_waarde_full, deposits, benchmark, writer, wb)
+    writer = write_returns_overview(
+        totals_dict, totals_waarde_full, simulation, writer, wb, formats, native_charts
+    )
+
+    # remove the cached plots that were not used for a while
+    prune_plot_cache()
 
+    logging.info('Registered ' + str(len(formats)) + ' cell formats')
     logging.info('Save Excel file to ' + output_path + ' folder')
     writer.save()
 
@@ -58,6 +75,10 @@ def main(output_path='results', use_rapid_api=False):
         logging.info('copy output to gsheet')
         copy_to_gsheet(excel_output, folder_id='1L8NuwR2LY3Z6FQaNA98iQ17CFRGi_2vD')
 
+    if use_rapid_api:
+        # expired responses are refreshed in the background for the next run
+        response_cache.wait()
+
     logging.info('Finished!')
 
 
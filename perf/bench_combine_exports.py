@@ -0,0 +1,117 @@
+"""
+Benchmark combining monthly exports into the wide portefeuille overview. Compares the former reduce of outer merges
+with combine_exports on synthetic exports of 60, 240 and 1000 snapshots, after checking that a position listed twice
+in one export is added up.
+
+Run from the repository root with: python -m perf.bench_combine_exports
+"""
+import time
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from src.read_data import combine_exports
+
+
+def make_exports(n_snapshots: int, n_products: int = 60, seed: int = 0) -> list:
+    """
+    Create synthetic parsed exports, with positions that are bought and sold over time.
+
+    :param n_snapshots: number of monthly snapshots.
+    :param n_products: number of distinct products over the full history.
+    :param seed: random seed.
+    :return: list of (date, parsed export) tuples.
+    """
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('1990-01-01', periods=n_snapshots, freq='MS').strftime('%Y-%m-%d')
+    products = np.array([f'PRODUCT {i}' for i in range(n_products)])
+    isins = np.array([f'NL{i:010d}' for i in range(n_products)])
+
+    exports = []
+    for date in dates:
+        held = rng.random(n_products) < 0.4
+        data_month = pd.DataFrame({
+            'Product': np.append(['CASH & CASH FUND & FTX CASH(EUR)'], products[held]),
+            'Symbool/ISIN': np.append(np.array([np.nan], dtype=object), isins[held]),
+            'Aantal': np.append([np.nan], rng.integers(1, 100, held.sum())),
+            'Waarde in EUR': rng.random(held.sum() + 1) * 1000,
+        })
+        exports.append((date, data_month))
+
+    return exports
+
+
+def combine_exports_reduce(exports: list) -> pd.DataFrame:
+    """
+    Former implementation of combine_exports, kept as reference.
+
+    :param exports: list of (date, parsed export) tuples.
+    :return portefeuille: overview of portefeuille combined.
+    """
+
+    portefeuille = [
+        data_month.rename(columns={'Aantal': date + ' (aantal)', 'Waarde in EUR': date + ' (waarde)'})
+        for date, data_month in exports
+    ]
+
+    product_isin = pd.concat(portefeuille)
+    product_isin = product_isin[product_isin['Symbool/ISIN'].notnull()][['Product', 'Symbool/ISIN']]
+    product_isin = product_isin.drop_duplicates(subset='Symbool/ISIN', keep='last')
+
+    portefeuille_updated = []
+    for port in portefeuille:
+        merged_df = port.merge(product_isin, on='Symbool/ISIN', how='left', suffixes=('', '_new'))
+        port['Product'] = merged_df['Product_new'].combine_first(merged_df['Product'])
+        portefeuille_updated.append(port)
+
+    portefeuille = reduce(lambda x, y: pd.merge(x, y, on=['Product', 'Symbool/ISIN'], how='outer'), portefeuille_updated)
+    portefeuille = portefeuille.replace('CASH & CASH FUND & FTX CASH(EUR)', 'VRIJE RUIMTE')
+    portefeuille.set_index(['Product', 'Symbool/ISIN'], inplace=True)
+    portefeuille = portefeuille.fillna(0)
+    return portefeuille
+
+
+def check_duplicate_positions():
+    """
+    Check that a position listed twice in one export, e.g. one fund on two exchanges, is added up.
+    """
+
+    data_month = pd.DataFrame({
+        'Product': ['CASH & CASH FUND & FTX CASH(EUR)', 'ISHARES CORE MSCI WORLD', 'ISHARES CORE MSCI WORLD'],
+        'Symbool/ISIN': [np.nan, 'IE00B4L5Y983', 'IE00B4L5Y983'],
+        'Aantal': [np.nan, 10, 4],
+        'Waarde in EUR': [100.0, 700.0, 280.0],
+    })
+    portefeuille = combine_exports([('2020-12-01', data_month)]).to_frame(['aantal', 'waarde'])
+
+    assert portefeuille.loc[('ISHARES CORE MSCI WORLD', 'IE00B4L5Y983')].tolist() == [14, 980]
+    assert portefeuille['2020-12-01 (waarde)'].sum() == 1080
+
+
+def time_it(function, exports: list) -> float:
+    """
+    Time a single call of function on exports.
+
+    :param function: function to time.
+    :param exports: list of (date, parsed export) tuples.
+    :return: seconds elapsed.
+    """
+
+    start = time.perf_counter()
+    function([(date, data_month.copy()) for date, data_month in exports])
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    check_duplicate_positions()
+    print(f"{'snapshots':>10} {'reduce (s)':>12} {'pivot (s)':>12} {'speedup':>9}")
+    for n_snapshots in [60, 240, 1000]:
+        exports = make_exports(n_snapshots)
+        pd.testing.assert_frame_equal(
+            combine_exports_reduce(exports), combine_exports(exports).to_frame(['aantal', 'waarde']), check_dtype=False
+        )
+        seconds_reduce = time_it(combine_exports_reduce, exports)
+        seconds_pivot = time_it(combine_exports, exports)
+        print(f'{n_snapshots:>10} {seconds_reduce:>12.3f} {seconds_pivot:>12.3f} {seconds_reduce / seconds_pivot:>8.0f}x')
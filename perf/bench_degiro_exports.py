@@ -0,0 +1,60 @@
+"""
+Benchmark downloading the DEGIRO reports over http, against the local stub server of perf/degiro_stub.py. Downloads
+the positionReport and the full cashAccountReport, and checks that a rejected session raises an HTTPError without
+leaving a partial file.
+
+Run from the repository root with: python -m perf.bench_degiro_exports
+"""
+import os
+import tempfile
+import time
+from datetime import date
+
+import requests
+
+import src.degiro_exports as degiro_exports
+from perf.degiro_stub import DegiroStub
+
+
+def time_downloads(session: requests.Session, output_dir: str, to_date: date) -> float:
+    """
+    Time the download of the positionReport and the full cashAccountReport.
+
+    :param session: requests Session object from create_session.
+    :param output_dir: folder to write the reports to.
+    :param to_date: last date of the reports.
+    :return: seconds elapsed.
+    """
+
+    start = time.perf_counter()
+    degiro_exports.download_report(
+        session, 'positionReport', {'toDate': degiro_exports.format_date(to_date)},
+        os.path.join(output_dir, f'{to_date}.csv')
+    )
+    degiro_exports.download_report(
+        session, 'cashAccountReport', {'fromDate': '27/05/1990', 'toDate': degiro_exports.format_date(to_date)},
+        os.path.join(output_dir, 'Account.csv')
+    )
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    stub = DegiroStub()
+    degiro_exports.degiro_base_url = stub.start()
+    to_date = date.today().replace(day=1)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        seconds = time_downloads(degiro_exports.create_session(stub.session_id), output_dir, to_date)
+        print(f"both reports downloaded in {seconds:.2f}s, {stub.stats['bytes']} bytes")
+
+        rejected_path = os.path.join(output_dir, 'rejected.csv')
+        try:
+            degiro_exports.download_report(
+                degiro_exports.create_session('expired'), 'positionReport',
+                {'toDate': degiro_exports.format_date(to_date)}, rejected_path
+            )
+        except requests.HTTPError as e:
+            print('rejected session raises ' + repr(e))
+        assert not os.path.exists(rejected_path) and not os.path.exists(rejected_path + '.tmp')
+
+    stub.stop()
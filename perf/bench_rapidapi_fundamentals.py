@@ -0,0 +1,47 @@
+"""
+Benchmark requesting the fundamentals of 10 holdings (40 requests), against the local stub server of
+perf/rapidapi_stub.py with 100 ms latency. Compares one worker with eight workers, and measures the throughput when
+the rate limiter is set to 5 requests per second.
+
+Run from the repository root with: python -m perf.bench_rapidapi_fundamentals
+"""
+import tempfile
+import time
+
+import src.rapidapi_data as rapidapi_data
+from perf.rapidapi_stub import RapidApiStub
+
+performance_ids = ['P%03d' % i for i in range(10)]
+
+
+def time_fundamentals(base_url: str, n_workers: int, rate: float) -> float:
+    """
+    Time requesting the fundamentals of all holdings, without response cache.
+
+    :param base_url: url of the stub.
+    :param n_workers: number of concurrent requests.
+    :param rate: maximum number of requests per second.
+    :return: seconds elapsed.
+    """
+
+    rapidapi_data.client = rapidapi_data.RapidApiClient(base_url=base_url, rate=rate, n_workers=n_workers)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        rapidapi_data.response_cache = rapidapi_data.ResponseCache(cache_dir, {})
+        start = time.perf_counter()
+        rapidapi_data.get_stock_fundamentals(performance_ids, n_workers=n_workers)
+        return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    stub = RapidApiStub(latency=0.1)
+    base_url = stub.start()
+    n_requests = 4 * len(performance_ids)
+
+    seconds_serial = time_fundamentals(base_url, n_workers=1, rate=1000)
+    seconds_concurrent = time_fundamentals(base_url, n_workers=8, rate=1000)
+    seconds_limited = time_fundamentals(base_url, n_workers=8, rate=5)
+    stub.stop()
+
+    print(f'{n_requests} requests with 1 worker: {seconds_serial:.2f}s')
+    print(f'{n_requests} requests with 8 workers: {seconds_concurrent:.2f}s')
+    print(f'rate limited to 5/s: {n_requests / seconds_limited:.1f} requests per second')
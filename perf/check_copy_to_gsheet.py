@@ -0,0 +1,69 @@
+"""
+Check the uploads of copy_to_gsheet, against the in-memory FakeDriveService of perf/fake_drive_service.py. After a
+first upload the same workbook is written again and skipped, a changed workbook overwrites the stored file, and when
+the stored file is no longer in Google Drive the 404 falls back to looking up and creating the file. The Google Drive
+calls are printed for every case.
+
+Run from the repository root with: python -m perf.check_copy_to_gsheet
+"""
+import json
+import os
+import tempfile
+
+import xlsxwriter
+
+from perf.fake_drive_service import FakeDriveService
+from src.copy_excel_to_gsheet import copy_to_gsheet
+
+folder_id = 'folder'
+excel_output = 'portefeuille.xlsx'
+state_path = os.path.join('data', 'cache', 'gsheet', f'{folder_id}_portefeuille.json')
+
+
+def write_workbook(value: float):
+    """
+    Write a small workbook to excel_output.
+
+    :param value: value of the single cell, a different value gives a changed workbook.
+    """
+
+    wb = xlsxwriter.Workbook(excel_output)
+    wb.add_worksheet('2021').write(0, 0, value)
+    wb.close()
+
+
+def run(label: str, drive_service: FakeDriveService, value: float, calls: list):
+    """
+    Write the workbook, copy it to the FakeDriveService and check the calls and the uploaded file.
+
+    :param label: name of the case to print.
+    :param drive_service: FakeDriveService to upload to.
+    :param value: value of the workbook.
+    :param calls: Google Drive calls the upload has to make.
+    """
+
+    write_workbook(value)
+    drive_service.calls.clear()
+    copy_to_gsheet(excel_output, folder_id, drive_service)
+    assert drive_service.calls == calls, drive_service.calls
+
+    with open(state_path) as f:
+        file_id = json.load(f)['file_id']
+    with open(excel_output, 'rb') as f:
+        assert drive_service.files_by_id[file_id]['content'] == f.read()
+    print(f'{label}: {", ".join(drive_service.calls) or "no calls"}')
+
+
+if __name__ == '__main__':
+    drive_service = FakeDriveService()
+
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        run('first upload', drive_service, 1, ['list', 'create'])
+        run('unchanged', drive_service, 1, [])
+        run('changed', drive_service, 2, ['update'])
+
+        # the stored file was removed from Google Drive
+        drive_service.files_by_id.clear()
+        run('404 on the stored file', drive_service, 3, ['update', 'list', 'create'])
+        os.chdir(os.path.dirname(root))
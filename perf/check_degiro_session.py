@@ -0,0 +1,85 @@
+"""
+Check reusing the stored DEGIRO login, against the local stub server of perf/degiro_stub.py. The browser login is
+replaced by a fake that logs in to the stub and counts the logins. A first run logs in and stores the state, a second
+run reuses the stored session without the browser, and an expired session triggers a new login. Without degiro-login
+in the environment the default state path raises a clear error.
+
+Run from the repository root with: python -m perf.check_degiro_session
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+import src.degiro_exports as degiro_exports
+from perf.degiro_stub import DegiroStub
+
+
+class FakeContext:
+    """
+    Browser context of the fake login, holding the session cookie of the stub.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.browser = self
+
+    def storage_state(self) -> dict:
+        return {'cookies': [{'name': 'JSESSIONID', 'value': self.session_id}], 'origins': []}
+
+    def close(self):
+        pass
+
+
+def fake_browser(stub: DegiroStub) -> list:
+    """
+    Replace the browser login of src/degiro_exports.py by a fake that logs in to the stub.
+
+    :param stub: DegiroStub to log in to.
+    :return: list that gets an item per login.
+    """
+
+    logins = []
+
+    @contextmanager
+    def sync_playwright():
+        yield None
+
+    def login_degiro(p):
+        logins.append(stub.session_id)
+        return None, FakeContext(stub.session_id)
+
+    degiro_exports.sync_playwright = sync_playwright
+    degiro_exports.login_degiro = login_degiro
+    degiro_exports.get_session_id = lambda page, context: context.session_id
+
+    return logins
+
+
+if __name__ == '__main__':
+    stub = DegiroStub()
+    degiro_exports.degiro_base_url = stub.start()
+    logins = fake_browser(stub)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        state_path = os.path.join(state_dir, 'degiro', 'account.json')
+
+        assert degiro_exports.get_degiro_session_id(state_path) == 'valid' and len(logins) == 1
+        assert oct(os.stat(state_path).st_mode & 0o777) == '0o600'
+        print('first run logs in and stores the state')
+
+        assert degiro_exports.get_degiro_session_id(state_path) == 'valid' and len(logins) == 1
+        print('second run reuses the stored session without the browser')
+
+        stub.session_id = 'renewed'
+        assert degiro_exports.get_degiro_session_id(state_path) == 'renewed' and len(logins) == 2
+        print('expired session triggers a new login')
+
+    os.environ.pop('degiro-login', None)
+    try:
+        degiro_exports.get_degiro_session_id()
+    except RuntimeError as e:
+        print('missing degiro-login: ' + str(e))
+    else:
+        raise AssertionError('missing degiro-login did not raise RuntimeError')
+
+    stub.stop()
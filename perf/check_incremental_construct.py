@@ -0,0 +1,112 @@
+"""
+Check that the incremental construct gives the same portefeuille as a full construct. Synthetic exports are added one
+month at a time, across a year boundary and including a step with three new exports, and after every step the
+incremental result is compared cell by cell with a full construct of the same exports. Finally a known export is
+changed. The number of exports read per step is printed, the incremental construct only reads the new ones.
+
+Run from the repository root with: python -m perf.check_incremental_construct
+"""
+import os
+import random
+import tempfile
+
+import pandas as pd
+
+import src.construct_portefeuille as construct_portefeuille
+from src.read_data import read_exports
+
+products = [(f'STOCK {chr(65 + i)}', f'NL{i:010d}') for i in range(8)]
+
+
+def write_export(path: str, date: pd.Timestamp, rng: random.Random):
+    """
+    Write a synthetic DEGIRO portefeuille export.
+
+    :param path: folder to write the export to.
+    :param date: date of the export.
+    :param rng: random generator.
+    """
+
+    rows = [['CASH & CASH FUND & FTX CASH(EUR)', '', '', '', 'EUR 1', f'{rng.random() * 500:.2f}'.replace('.', ',')]]
+    for name, isin in products:
+        if rng.random() < 0.6:
+            aantal = rng.randint(1, 50)
+            rows.append([name, isin, aantal, 10, 'EUR 1', f'{aantal * rng.uniform(5, 50):.2f}'.replace('.', ',')])
+    export = pd.DataFrame(rows, columns=['Product', 'Symbool/ISIN', 'Aantal', 'Slotkoers', 'Lokale waarde',
+                                         'Waarde in EUR'])
+    export.to_csv(os.path.join(path, f'{date.date()}.csv'), index=False)
+
+
+def write_account(path: str, dates: pd.DatetimeIndex, rng: random.Random):
+    """
+    Write a synthetic rekeningoverzicht with deposits between the export dates.
+
+    :param path: path of Account.csv.
+    :param dates: export dates.
+    :param rng: random generator.
+    """
+
+    lines = ['Datum,Tijd,Valutadatum,Product,ISIN,Omschrijving,FX,Mutatie,,Saldo,,Order Id']
+    for date in reversed(dates):
+        day = date - pd.Timedelta(days=rng.randint(1, 20))
+        lines.append(f'{day:%d-%m-%Y},09:00,{day:%d-%m-%Y},,,iDEAL storting,,EUR,{rng.randint(50, 500)}.0,EUR,0,')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def assert_equal(incremental: tuple, full: tuple):
+    """
+    Compare the results of construct_portefeuille cell by cell.
+
+    :param incremental: result of the incremental construct.
+    :param full: result of the full construct.
+    """
+
+    for result_incremental, result_full in zip(incremental[:3], full[:3]):
+        assert list(result_incremental) == list(result_full)
+        for year in result_full:
+            if isinstance(result_full[year], pd.Series):
+                pd.testing.assert_series_equal(result_incremental[year], result_full[year])
+            else:
+                pd.testing.assert_frame_equal(result_incremental[year], result_full[year])
+    pd.testing.assert_frame_equal(incremental[3], full[3])
+
+
+if __name__ == '__main__':
+    rng = random.Random(0)
+    dates = pd.date_range('2019-07-01', periods=14, freq='MS')
+    steps = [dates[:4]] + [dates[i:i + 1] for i in range(4, 11)] + [dates[11:]]
+
+    n_read = []
+
+    def counted_read_exports(*args) -> list:
+        exports = read_exports(*args)
+        n_read.append(len(exports))
+        return exports
+
+    construct_portefeuille.read_exports = counted_read_exports
+
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        os.makedirs(os.path.join('data', 'exports'))
+        os.makedirs(os.path.join('data', 'deposits'))
+        write_account(os.path.join('data', 'deposits', 'Account.csv'), dates, rng)
+
+        for step in steps:
+            for date in step:
+                write_export(os.path.join('data', 'exports'), date, rng)
+            n_read.clear()
+            incremental = construct_portefeuille.construct_portefeuille(incremental=True)
+            full = construct_portefeuille.construct_portefeuille(incremental=False)
+            assert_equal(incremental, full)
+            print(f'{step[-1].date()}: {len(step)} new, {n_read[0]} exports read, incremental equals full')
+
+        # a changed known export invalidates the state, all exports are read again
+        write_export(os.path.join('data', 'exports'), dates[2], rng)
+        n_read.clear()
+        assert_equal(
+            construct_portefeuille.construct_portefeuille(incremental=True),
+            construct_portefeuille.construct_portefeuille(incremental=False)
+        )
+        print(f'{dates[2].date()} changed: {sum(n_read)} exports read, incremental equals full')
+        os.chdir(os.path.dirname(root))
@@ -0,0 +1,62 @@
+"""
+Check the response cache of the rapid-api, against the local stub server of perf/rapidapi_stub.py with 200 ms latency.
+The fundamentals of 10 holdings (40 requests) are requested with an empty cache, again with a warm cache, once all
+responses expired but are within their maximum stale age, and once the realtime data is past its maximum stale age.
+The number of API calls and the seconds elapsed are printed for every case.
+
+Run from the repository root with: python -m perf.check_rapidapi_cache
+"""
+import tempfile
+import time
+
+import src.rapidapi_data as rapidapi_data
+from perf.rapidapi_stub import RapidApiStub
+
+performance_ids = ['P%03d' % i for i in range(10)]
+endpoints = ['stock/get-detail', 'stock/v2/get-competitors', 'stock/v2/get-key-stats', 'stock/v2/get-realtime-data']
+
+
+def run(label: str, stub: RapidApiStub, cache: rapidapi_data.ResponseCache) -> tuple:
+    """
+    Request the fundamentals of all holdings through cache, and print the API calls and seconds it took.
+
+    :param label: name of the case to print.
+    :param stub: RapidApiStub the client requests.
+    :param cache: ResponseCache to use.
+    :return: number of API calls started before the fundamentals were returned, and the seconds it took.
+    """
+
+    rapidapi_data.response_cache = cache
+    n_requests = stub.stats['requests']
+    start = time.perf_counter()
+    rapidapi_data.get_stock_fundamentals(performance_ids, n_workers=8)
+    seconds = time.perf_counter() - start
+    n_calls = stub.stats['requests'] - n_requests
+    print(f'{label}: {n_calls} API calls started, returned in {seconds:.2f}s')
+
+    return n_calls, seconds
+
+
+if __name__ == '__main__':
+    stub = RapidApiStub(latency=0.2)
+    rapidapi_data.client = rapidapi_data.RapidApiClient(base_url=stub.start(), rate=1000, n_workers=16)
+    ttl = dict.fromkeys(endpoints, 3600)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        assert run('cold', stub, rapidapi_data.ResponseCache(cache_dir, ttl))[0] == 40
+        assert run('warm', stub, rapidapi_data.ResponseCache(cache_dir, ttl))[0] == 0
+
+        # expired, but within the maximum stale age: returned without waiting for any request, and revalidated in
+        # the background
+        cache = rapidapi_data.ResponseCache(cache_dir, dict.fromkeys(endpoints, 0), dict.fromkeys(endpoints, 3600))
+        assert run('expired, within maximum stale age', stub, cache)[1] < stub.latency
+        cache.wait()
+        print(f'revalidated in the background: {stub.stats["requests"] - 40} API calls')
+
+        # realtime data past its maximum stale age: fetched before it is returned
+        cache = rapidapi_data.ResponseCache(
+            cache_dir, {**ttl, 'stock/v2/get-realtime-data': 0}, {'stock/v2/get-realtime-data': 0}
+        )
+        assert run('realtime past maximum stale age', stub, cache)[0] == 10
+
+    stub.stop()
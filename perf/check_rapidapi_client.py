@@ -0,0 +1,73 @@
+"""
+Check the retries and metrics of the rapid-api client, against the local stub server of perf/rapidapi_stub.py. The
+fundamentals of 10 holdings are requested while the stub answers every third request with 429 and a Retry-After
+header, every fourth request with 503, or with an invalid Retry-After header. Timeouts, refused connections and 404
+responses are checked on single requests. The client summary is printed for every case.
+
+Run from the repository root with: python -m perf.check_rapidapi_client
+"""
+import tempfile
+
+import requests
+
+import src.rapidapi_data as rapidapi_data
+from perf.rapidapi_stub import RapidApiStub
+
+performance_ids = ['P%03d' % i for i in range(10)]
+
+
+def check_fundamentals(label: str, stub: RapidApiStub):
+    """
+    Request the fundamentals of all holdings from the stub, without response cache, and check that all arrive.
+
+    :param label: name of the case to print.
+    :param stub: RapidApiStub to request.
+    """
+
+    rapidapi_data.client = rapidapi_data.RapidApiClient(base_url=stub.start(), rate=1000, n_workers=8, backoff=0.05)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        rapidapi_data.response_cache = rapidapi_data.ResponseCache(cache_dir, {})
+        res = rapidapi_data.get_stock_fundamentals(performance_ids, n_workers=8)
+    stub.stop()
+
+    assert [stock['RegionAndTicker'] for stock in res] == ['NL:' + performance_id for performance_id in performance_ids]
+    print(label + ': ' + rapidapi_data.client.summary())
+
+
+def check_request(label: str, client: rapidapi_data.RapidApiClient, error: type):
+    """
+    Do a single request that fails, and check that it raises error.
+
+    :param label: name of the case to print.
+    :param client: RapidApiClient to request with.
+    :param error: exception the request has to raise after its retries.
+    """
+
+    try:
+        client.get_json('stock/get-detail', {'PerformanceId': 'P000'})
+    except error:
+        print(label + ': ' + client.summary())
+    else:
+        raise AssertionError(label + ' did not raise ' + error.__name__)
+
+
+if __name__ == '__main__':
+    check_fundamentals('429 every third request', RapidApiStub(fail_every=3, retry_after='0.1'))
+    check_fundamentals('503 every fourth request', RapidApiStub(fail_every=4, fail_status=503))
+    check_fundamentals('invalid Retry-After', RapidApiStub(fail_every=3, retry_after='soon'))
+
+    stub = RapidApiStub(latency=0.5)
+    check_request(
+        'timeout', rapidapi_data.RapidApiClient(base_url=stub.start(), rate=1000, timeout=0.1, max_retries=1),
+        requests.Timeout
+    )
+    stub.stop()
+
+    stub = RapidApiStub()
+    check_request('404', rapidapi_data.RapidApiClient(base_url=stub.start() + 'unknown/', rate=1000), requests.HTTPError)
+    stub.stop()
+
+    check_request(
+        'connection refused', rapidapi_data.RapidApiClient(base_url=stub.base_url, rate=1000, backoff=0.05),
+        requests.ConnectionError
+    )
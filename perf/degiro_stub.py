@@ -0,0 +1,139 @@
+"""
+Local stub of the DEGIRO endpoints used by src/degiro_exports.py, to download reports without a DEGIRO account. It
+serves login/secure/config and the positionReport and cashAccountReport csv reports for one valid session id, with an
+optional latency and failure rate, and counts the requests.
+
+Run from the repository root with: python -m perf.degiro_stub [port]
+"""
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+POSITION_HEADER = 'Product,Symbool/ISIN,Aantal,Slotkoers,Lokale waarde,Waarde in EUR\n'
+ACCOUNT_HEADER = 'Datum,Tijd,Valutadatum,Product,ISIN,Omschrijving,FX,Mutatie,,Saldo,,Order Id\n'
+
+
+def position_report(to_date: date) -> str:
+    """
+    :param to_date: date of the report.
+    :return: csv of a portfolio with cash and one stock, the values depend on the date.
+    """
+
+    return (
+        POSITION_HEADER +
+        f'CASH & CASH FUND & FTX CASH(EUR),,,,EUR {to_date.day},"{to_date.day},00"\n'
+        f'STOCK A,US0000000001,3,10,EUR 30,"30,{to_date.month:02}"\n'
+    )
+
+
+def account_report(from_date: date, to_date: date) -> str:
+    """
+    :param from_date: first date of the report.
+    :param to_date: last date of the report.
+    :return: csv with one deposit per day from 2015, newest first, and two deposits on every 10th day of a month.
+    """
+
+    rows = []
+    day = max(from_date, date(2015, 1, 1))
+    while day <= to_date:
+        row = f'{day:%d-%m-%Y},09:00,{day:%d-%m-%Y},,,"iDEAL storting, {day.day}",,EUR,{day.day}.0,EUR,100.0,\n'
+        rows.append(row * (2 if day.day % 10 == 0 else 1))
+        day += timedelta(days=1)
+
+    return ACCOUNT_HEADER + ''.join(reversed(rows))
+
+
+class DegiroStub:
+    """
+    Stub server of DEGIRO, running in a background thread. Only requests with session_id as cookie and as query
+    parameter are accepted. Every fail_every-th report request is answered with 503.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0, fail_every: int = 0, session_id: str = 'valid'):
+        """
+        :param port: port to listen on, a free port if 0.
+        :param latency: seconds to wait before answering a report request.
+        :param fail_every: answer every fail_every-th report request with 503, never if 0.
+        :param session_id: the session id that is logged in, change it to expire the session.
+        """
+
+        self.latency = latency
+        self.fail_every = fail_every
+        self.session_id = session_id
+        self.stats = {'requests': 0, 'active': 0, 'max_active': 0, 'bytes': 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}/'
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, code: int, data: bytes, content_type: str = 'text/csv'):
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                logged_in = 'JSESSIONID=' + stub.session_id in self.headers.get('Cookie', '')
+                if url.path == '/login/secure/config':
+                    return self.send(200 if logged_in else 401, b'{"data": {}}', 'application/json')
+
+                with stub.lock:
+                    stub.stats['requests'] += 1
+                    n = stub.stats['requests']
+                    stub.stats['active'] += 1
+                    stub.stats['max_active'] = max(stub.stats['max_active'], stub.stats['active'])
+                time.sleep(stub.latency)
+                with stub.lock:
+                    stub.stats['active'] -= 1
+
+                if not logged_in or query.get('sessionId') != stub.session_id:
+                    return self.send(401, b'unauthorized')
+                if stub.fail_every and n % stub.fail_every == 0:
+                    return self.send(503, b'busy')
+
+                to_date = datetime.strptime(query['toDate'], '%d/%m/%Y').date()
+                if url.path.endswith('positionReport/csv'):
+                    data = position_report(to_date).encode()
+                elif url.path.endswith('cashAccountReport/csv'):
+                    data = account_report(datetime.strptime(query['fromDate'], '%d/%m/%Y').date(), to_date).encode()
+                else:
+                    return self.send(404, b'not found')
+                with stub.lock:
+                    stub.stats['bytes'] += len(data)
+                self.send(200, data)
+
+        return Handler
+
+    def start(self) -> str:
+        """
+        Start serving in a background thread.
+
+        :return: base url of the stub, to use as degiro_base_url.
+        """
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    stub = DegiroStub(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8770)
+    print('DEGIRO stub on ' + stub.base_url + ', session id ' + stub.session_id)
+    stub.server.serve_forever()
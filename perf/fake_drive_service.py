@@ -0,0 +1,100 @@
+"""
+Local stand-in for the Google Drive API client used by src/copy_excel_to_gsheet.py, to run copy_to_gsheet without a
+Google account. It is used by perf/check_copy_to_gsheet.py.
+"""
+import uuid
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+class FakeRequest:
+    """
+    Request of the FakeDriveService, runs when it is executed like a Google API request.
+    """
+
+    def __init__(self, run):
+        """
+        :param run: function that returns the response.
+        """
+
+        self.run = run
+
+    def execute(self):
+        return self.run()
+
+
+class FakeDriveService:
+    """
+    Local stand-in for the Google Drive API client, to run copy_to_gsheet without Google Drive. It supports
+    files().list, files().create and files().update, keeps the files in memory and records the calls. Uploads are read
+    in chunks like a resumable upload, and unknown file ids raise a 404 HttpError.
+    """
+
+    def __init__(self):
+        self.files_by_id = {}
+        self.calls = []
+
+    def files(self):
+        return self
+
+    def list(self, q: str, **kwargs) -> FakeRequest:
+        """
+        :param q: query of the form "name contains '<name>' and '<folder_id>' in parents".
+        :return: request for the files in the folder that contain the name.
+        """
+
+        self.calls.append('list')
+        name, folder_id = q.split("'")[1], q.split("'")[3]
+        return FakeRequest(lambda: {'files': [
+            {'id': file_id, 'name': file['name']} for file_id, file in self.files_by_id.items()
+            if name in file['name'] and folder_id in file['parents']
+        ]})
+
+    def create(self, body: dict, media_body, **kwargs) -> FakeRequest:
+        """
+        :param body: Dict with the metadata of the file, name and parents.
+        :param media_body: upload of the file contents.
+        :return: request that creates the file.
+        """
+
+        self.calls.append('create')
+
+        def run():
+            file_id = uuid.uuid4().hex
+            self.files_by_id[file_id] = {
+                'name': body['name'], 'parents': body.get('parents', []), 'content': self.read(media_body)
+            }
+            return {'id': file_id}
+
+        return FakeRequest(run)
+
+    def update(self, fileId: str, media_body, **kwargs) -> FakeRequest:
+        """
+        :param fileId: Id of the file to overwrite.
+        :param media_body: upload of the file contents.
+        :return: request that overwrites the file.
+        """
+
+        self.calls.append('update')
+
+        def run():
+            if fileId not in self.files_by_id:
+                raise HttpError(httplib2.Response({'status': 404}), b'File not found: ' + fileId.encode())
+            self.files_by_id[fileId]['content'] = self.read(media_body)
+            return {'id': fileId}
+
+        return FakeRequest(run)
+
+    @staticmethod
+    def read(media_body) -> bytes:
+        """
+        :param media_body: upload of the file contents, e.g. a MediaFileUpload.
+        :return: contents of the file, read chunk by chunk.
+        """
+
+        content = b''
+        while len(content) < media_body.size():
+            content += media_body.getbytes(len(content), media_body.chunksize())
+
+        return content
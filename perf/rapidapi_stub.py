@@ -0,0 +1,136 @@
+"""
+Local stub of the morning-star rapid-api endpoints used by src/rapidapi_data.py, to request fundamentals without an
+API key. It answers stock/get-detail, stock/v2/get-competitors, stock/v2/get-key-stats and stock/v2/get-realtime-data
+with fixed responses per performance id, with an optional latency and failure rate, and counts the requests.
+
+Run from the repository root with: python -m perf.rapidapi_stub [port]
+"""
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+def stub_response(endpoint: str, performance_id: str):
+    """
+    :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+    :param performance_id: String with performance ID.
+    :return: response of the endpoint, None for unknown endpoints.
+    """
+
+    if endpoint == 'stock/get-detail':
+        return [{
+            'Currency': 'EUR', 'Exchange': 'XAMS', 'TypeName': 'Stock', 'Sector': 'Technology',
+            'Industry': 'Software', 'RegionAndTicker': 'NL:' + performance_id,
+            'Detail': {'ForwardDividendYield': 1.5, 'EarningsPerShare': {'TrailingTwelveMonths': 2.1}}
+        }]
+    if endpoint == 'stock/v2/get-competitors':
+        return {
+            'main': {'priceEarnings': 12.3, 'dividendYield': 0.5},
+            'competitors': [{'name': 'Competitor A'}, {'name': 'Competitor B'}]
+        }
+    if endpoint == 'stock/v2/get-key-stats':
+        return {
+            key: {'stockValue': 1.0} for key in [
+                'revenue3YearGrowth', 'netIncome3YearGrowth', 'operatingMarginTTM', 'netMarginTTM', 'roeTTM',
+                'debitToEquity'
+            ]
+        }
+    if endpoint == 'stock/v2/get-realtime-data':
+        return {'lastPrice': 100.0, 'dividendYield': 2.0, 'yearRangeHigh': 120, 'yearRangeLow': 80, 'type': 'stock'}
+
+    return None
+
+
+class RapidApiStub:
+    """
+    Stub server of the morning-star rapid-api, running in a background thread. Every fail_every-th request is answered
+    with fail_status, with a Retry-After header if retry_after is set. Every response has a remaining quota header.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0, fail_every: int = 0, fail_status: int = 429,
+                 retry_after: str = None, quota: int = 10000):
+        """
+        :param port: port to listen on, a free port if 0.
+        :param latency: seconds to wait before answering a request.
+        :param fail_every: answer every fail_every-th request with fail_status, never if 0.
+        :param fail_status: status of the failed requests, e.g. 429 or 503.
+        :param retry_after: value of the Retry-After header of the failed requests, none if None.
+        :param quota: number of requests of the plan, the remaining quota is sent with every response.
+        """
+
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.quota = quota
+        self.stats = {'requests': 0, 'active': 0, 'max_active': 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}/'
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key.lower(): values[0] for key, values in parse_qs(url.query).items()}
+
+                with stub.lock:
+                    stub.stats['requests'] += 1
+                    n = stub.stats['requests']
+                    stub.stats['active'] += 1
+                    stub.stats['max_active'] = max(stub.stats['max_active'], stub.stats['active'])
+                time.sleep(stub.latency)
+                with stub.lock:
+                    stub.stats['active'] -= 1
+
+                response = stub_response(url.path.strip('/'), query.get('performanceid', ''))
+                if stub.fail_every and n % stub.fail_every == 0:
+                    status, data = stub.fail_status, b'{"message": "Too many requests"}'
+                elif response is None:
+                    status, data = 404, b'{"message": "Endpoint does not exist"}'
+                else:
+                    status, data = 200, json.dumps(response).encode()
+
+                try:
+                    self.send_response(status)
+                    if status == stub.fail_status and stub.retry_after is not None:
+                        self.send_header('Retry-After', stub.retry_after)
+                    self.send_header('X-RateLimit-Requests-Remaining', str(max(stub.quota - n, 0)))
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client stopped waiting, e.g. after a timeout
+
+        return Handler
+
+    def start(self) -> str:
+        """
+        Start serving in a background thread.
+
+        :return: base url of the stub, to use as rapidapi_base_url.
+        """
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    stub = RapidApiStub(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print('rapid-api stub on ' + stub.base_url)
+    stub.server.serve_forever()
@@ -1,6 +1,8 @@
 # formatting - header
 header_r = {'bold': True, 'font_size': 24, 'align': 'right'}
 header_l = {'bold': True, 'font_size': 24, 'align': 'left'}
+# header and index of the dataframes written with write_frame, like DataFrame.to_excel
+frame_header = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
 
 # formatting - portefeuille
 header_color = '#ECA359'
@@ -43,4 +45,63 @@ months_translation = {
     'December': 'December'
 }
 
-rekeningoverzicht_filename = 'Account.csv'
\ No newline at end of file
+rekeningoverzicht_filename = 'Account.csv'
+
+# number of processes to parse new exports with, set to 1 to parse them one after another
+export_workers = 1
+
+# keep the constructed portefeuille in data/cache and only compute new exports on the next run
+incremental_construct = False
+
+# write the Excel output with xlsxwriter's constant_memory option, rows are streamed to disk instead of kept in memory
+excel_constant_memory = False
+
+# number of processes to render the matplotlib images with, set to 1 to render them one after another
+plot_workers = 1
+
+# days a rendered plot is kept in data/cache/plots after it was last used
+plot_cache_max_age = 90
+
+# add native Excel charts that reference the data on the sheets, instead of rendering matplotlib images
+excel_native_charts = False
+
+# only use the local price store in data/benchmarks for the benchmarks, nothing is downloaded
+benchmarks_offline = False
+
+# number of concurrent requests to the rapid-api and the maximum number of requests per second of the plan
+rapidapi_workers = 4
+rapidapi_rate = 5
+
+# seconds to keep the rapid-api responses per endpoint in data/cache/rapidapi, expired responses are refreshed in the
+# background. Responses older than rapidapi_cache_max_stale seconds are not used but fetched again before they are
+# returned, so realtime data is never stale. With rapidapi_cache_only only cached responses are used
+rapidapi_cache_ttl = {
+    'stock/get-detail': 7 * 24 * 3600,
+    'stock/v2/get-competitors': 7 * 24 * 3600,
+    'stock/v2/get-key-stats': 24 * 3600,
+    'stock/v2/get-realtime-data': 15 * 60
+}
+rapidapi_cache_max_stale = {
+    'stock/get-detail': 30 * 24 * 3600,
+    'stock/v2/get-competitors': 30 * 24 * 3600,
+    'stock/v2/get-key-stats': 7 * 24 * 3600,
+    'stock/v2/get-realtime-data': 15 * 60
+}
+rapidapi_cache_only = False
+
+# url of the rapid-api (e.g. a local stub server for testing), seconds to wait for a response and number of retries
+rapidapi_base_url = 'https://morning-star.p.rapidapi.com/'
+rapidapi_timeout = 10
+rapidapi_retries = 5
+
+# DEGIRO site to login and download the reports from (e.g. a local stub server for testing), the account number of the
+# reports and whether the browser to login with is hidden
+degiro_base_url = 'https://trader.degiro.nl/'
+degiro_int_account = 1218922
+degiro_headless = True
+
+# number of concurrent downloads when backfilling missing exports
+degiro_workers = 4
+
+# size in bytes of the chunks to upload the Excel file to Google Drive with, a multiple of 256 KB
+gsheet_chunk_size = 5 * 1024 * 1024
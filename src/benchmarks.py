@@ -1,29 +1,219 @@
+import os
+
+import numpy as np
 import pandas as pd
 from datetime import datetime as dt
 import yfinance as yf
 
+from settings import benchmarks_offline
+
+ticker_symbols = {
+    'CSPX.AS': 'SP500',  # S&P500 Acc EUR
+    'IWDA.AS': 'MSCI_World',  # MSCI Acc EUR
+    'IAEA.AS': 'AEX',  # AEX Acc EUR
+}
 
-def load_benchmarks():
+
+class YahooProvider:
+    """
+    Price provider that downloads daily close prices from Yahoo Finance.
+    """
+
+    def history(self, ticker: str, start: pd.Timestamp = None) -> pd.Series:
+        """
+        :param ticker: ticker symbol, e.g. 'IWDA.AS'.
+        :param start: first date to download, the full history if None.
+        :return: Series with close prices indexed on date.
+        """
+
+        if start is None:
+            history = yf.Ticker(ticker).history(period='max')
+        else:
+            history = yf.Ticker(ticker).history(start=start.strftime('%Y-%m-%d'))
+
+        close = history['Close']
+        if close.index.tz is not None:
+            close.index = close.index.tz_localize(None)
+        close.index = close.index.normalize()
+
+        return close
+
+
+class FileProvider:
+    """
+    Price provider that reads close prices from csv files '<ticker>.csv' with a date and close column, e.g. to run
+    without network access.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: folder with a csv file per ticker.
+        """
+
+        self.path = path
+
+    def history(self, ticker: str, start: pd.Timestamp = None) -> pd.Series:
+        """
+        :param ticker: ticker symbol, e.g. 'IWDA.AS'.
+        :param start: first date to read, the full history if None.
+        :return: Series with close prices indexed on date.
+        """
+
+        prices = pd.read_csv(os.path.join(self.path, ticker + '.csv'), parse_dates=['date'])
+        close = prices.set_index('date')['close'].sort_index()
+
+        return close if start is None else close[close.index >= start]
+
+
+def update_prices(ticker: str, provider, store_dir: str, offline: bool = False) -> pd.Series:
+    """
+    Get the close prices of a ticker from the local price store. Only the days from the last stored date onwards are
+    fetched from the provider, the last stored day is fetched again as it may have been stored during trading hours.
+
+    :param ticker: ticker symbol, e.g. 'IWDA.AS'.
+    :param provider: price provider with a history(ticker, start) method, e.g. YahooProvider.
+    :param store_dir: folder of the price store, with a Parquet file per ticker.
+    :param offline: only use the price store, nothing is fetched.
+    :return: Series with close prices indexed on date.
+    """
+
+    path = os.path.join(store_dir, ticker + '.parquet')
+    stored = pd.Series(dtype=float)
+    if os.path.exists(path):
+        stored = pd.read_parquet(path).set_index('date')['close']
+
+    if offline:
+        if stored.empty:
+            raise FileNotFoundError('No stored prices for ' + ticker + ' in ' + store_dir + ', run once while online.')
+        return stored
+
+    start = stored.index[-1] if len(stored) else None
+    new = provider.history(ticker, start)
+    if new.empty:
+        return stored
+
+    prices = pd.concat([stored[stored.index < new.index[0]], new]).rename('close')
+    prices.index.name = 'date'
+    os.makedirs(store_dir, exist_ok=True)
+    prices.reset_index().to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+    return prices
+
+
+class Benchmark:
+    """
+    Close prices of the benchmarks on their own trading days. Prices on other days are looked up as-of: the price of
+    the first trading day on or after the date, or the last price if there is none. Only dates from the first trading
+    day of any benchmark up to today have a price.
+    """
+
+    def __init__(self, prices: dict, end: pd.Timestamp = None):
+        """
+        :param prices: dict with a Series of close prices indexed on date per benchmark name.
+        :param end: last date with a price, today by default.
+        """
+
+        self.names = list(prices)
+        self.series = [series.dropna().sort_index() for series in prices.values()]
+        self.start = min(series.index[0] for series in self.series)
+        self.end = pd.Timestamp(dt.now().date()) if end is None else end
+
+    def covers(self, dates) -> np.ndarray:
+        """
+        :param dates: dates to check.
+        :return: boolean array, True for the dates that have a price.
+        """
+
+        dates = pd.DatetimeIndex(dates)
+        return np.asarray((dates >= self.start) & (dates <= self.end))
+
+    def prices(self, dates) -> np.ndarray:
+        """
+        Look up the benchmark prices on dates.
+
+        :param dates: dates to look up.
+        :return: float array of dates x benchmarks, nan for the dates that are not covered.
+        """
+
+        dates = pd.DatetimeIndex(dates)
+        prices = np.empty((len(dates), len(self.names)))
+        for i, series in enumerate(self.series):
+            positions = np.minimum(series.index.searchsorted(dates, side='left'), len(series) - 1)
+            prices[:, i] = series.to_numpy()[positions]
+        prices[~self.covers(dates)] = np.nan
+
+        return prices
+
+
+def load_benchmarks(provider=None, store_dir: str = os.path.join('data', 'benchmarks'),
+                    offline: bool = benchmarks_offline) -> Benchmark:
     """
     Load historic prices of a few ETFs.
+
+    :param provider: price provider with a history(ticker, start) method, YahooProvider by default.
+    :param store_dir: folder of the local price store.
+    :param offline: only use the local price store, nothing is downloaded.
+    :return: Benchmark with the prices per ETF.
     """
 
-    ticker_symbols = {
-        'CSPX.AS': 'price_SP500',  # S&P500 Acc EUR
-        'IWDA.AS': 'price_MSCI_World',  # MSCI Acc EUR
-        'IAEA.AS': 'price_AEX',  # AEX Acc EUR
-    }
-    history = yf.Tickers(' '.join(ticker_symbols.keys())).history(period='max')
-    history = history.loc[:, history.columns.get_level_values(0) == 'Close']
-    history.columns = history.columns.get_level_values(1)
-    history = history.reset_index()
-    history = history.rename(columns={'Date': 'date', **ticker_symbols})
-
-    dates = pd.DataFrame(
-        data={'date': pd.date_range(start=history['date'][0], end=dt.now().date(), freq='1D').date}
-    )
-    dates['date'] = pd.to_datetime(dates['date'])
-    dates = dates.merge(history, on='date', how='left')
-    dates = dates.fillna(method='bfill').fillna(method='ffill')
-
-    return dates
+    provider = YahooProvider() if provider is None else provider
+    return Benchmark({
+        name: update_prices(ticker, provider, store_dir, offline) for ticker, name in ticker_symbols.items()
+    })
+
+
+class BenchmarkSimulation:
+    """
+    Simulate the value of the deposits if they were invested in the benchmarks instead. The units bought per deposit
+    are calculated once, as a matrix of deposits x benchmarks, for the full history. Any period of export dates is
+    simulated from a slice of this matrix, starting with the portefeuille value at the start of the period.
+    """
+
+    def __init__(self, deposits: pd.DataFrame, benchmark: Benchmark):
+        """
+        :param deposits: Dataframe with deposits made, one row per export date.
+        :param benchmark: Benchmark with pricing data.
+        """
+
+        self.benchmark = benchmark
+        self.names = benchmark.names
+
+        # deposits on dates without benchmark price can not be invested
+        deposits = deposits.sort_values('Datum')
+        deposits = deposits[benchmark.covers(deposits['Datum'])]
+        self.dates = pd.DatetimeIndex(deposits['Datum'])
+        self.deposit_prices = benchmark.prices(self.dates)
+        self.units = deposits[['Storting']].to_numpy() / self.deposit_prices
+
+    def simulate(self, totals_waarde: pd.DataFrame) -> pd.DataFrame:
+        """
+        Simulate the benchmark values for a period of export dates. The value is updated on the start date and on every
+        deposit, in between the value at the last update is shown.
+
+        :param totals_waarde: Dataframe with total waarde, 'index' holds the export dates of the period.
+        :return totals_waarde: Dataframe with total waarde and a column with the simulated value per benchmark.
+        """
+
+        dates = pd.DatetimeIndex(pd.to_datetime(totals_waarde['index']))
+        deposits = slice(*self.dates.searchsorted([dates[0], dates[-1]], side='right'))
+
+        # the period starts with investing the portefeuille value at the first date
+        update_dates, units, prices = self.dates[deposits], self.units[deposits], self.deposit_prices[deposits]
+        if self.benchmark.covers(dates[:1])[0]:
+            start_prices = self.benchmark.prices(dates[:1])
+            update_dates = update_dates.insert(0, dates[0])
+            units = np.concatenate([totals_waarde['Portefeuille'].iloc[0] / start_prices, units])
+            prices = np.concatenate([start_prices, prices])
+        values = units.cumsum(axis=0) * prices
+
+        # as-of lookup of the last update, dates before the first update take the first update
+        simulated = np.full((len(dates), len(self.names)), np.nan)
+        if len(update_dates):
+            positions = np.maximum(update_dates.searchsorted(dates, side='right') - 1, 0)
+            simulated = values[positions]
+
+        totals_waarde = totals_waarde.copy()
+        totals_waarde[self.names] = simulated
+
+        return totals_waarde
@@ -1,101 +1,99 @@
+import os
 import warnings
 from typing import Tuple
 
-import datetime as dt
+import numpy as np
 import pandas as pd
 
-from src.read_data import read_portefeuille, read_deposits
+from settings import export_workers, incremental_construct
+from src.holdings import Holdings, metrics
+from src.read_data import read_holdings, read_deposits, read_exports, read_fingerprints, combine_exports, \
+    list_filenames
+from src.state import hash_deposits, load_state, save_state
 
 
-def add_percentages(portefeuille: pd.DataFrame) -> pd.DataFrame:
+def add_percentages(holdings: Holdings) -> Holdings:
     """
-    Add percentages to portefeuille dataframe.
+    Add percentage change per share to the holdings.
 
-    :param portefeuille: Dataframe with portefeuille data.
-    :return portefeuille: Dataframe with percentage data appended.
+    :param holdings: Holdings with aantal and waarde.
+    :return holdings: Holdings with procent filled in (zero for the first date).
     """
 
-    # init first column
-    col_date = portefeuille.columns[0].replace('(aantal)', '').replace('(waarde)', '')
-    portefeuille.insert(2, col_date + '(procent)', 0)
+    # percentage change per share for all dates at once (if now and prev date #shares > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = holdings.waarde / holdings.aantal
+        percent_change = (values[:, 1:] - values[:, :-1]) / values[:, :-1]
+    holdings.procent[:, 1:] = np.where(np.isnan(percent_change), 0, percent_change).round(2)
 
-    # insert remaining columns
-    for i in range(5, int(1.5 * len(portefeuille.columns)), 3):
-        col_date_prev = col_date
-        col_date = portefeuille.columns[i - 1].replace('(aantal)', '').replace('(waarde)', '')
+    return holdings
 
-        # calculate percentage change per share (if now and prev date #shares > 0)
-        values_old = portefeuille[col_date_prev + '(waarde)'] / portefeuille[col_date_prev + '(aantal)']
-        values_new = portefeuille[col_date + '(waarde)'] / portefeuille[col_date + '(aantal)']
-        percent_change = (values_new - values_old) / values_old
-        percent_change = percent_change.fillna(0).round(2)
 
-        # insert columns
-        portefeuille.insert(i, col_date + '(procent)', percent_change)
-
-    return portefeuille
-
-
-def calculate_totals(portefeuille: pd.DataFrame, deposits: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+def calculate_totals(holdings: Holdings, deposits: pd.DataFrame, first_total: np.ndarray = None) \
+        -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Create total overview of portefeuille. The following information is created:
         - Totaal portefeuille
         - Verschil t.o.v. vorige maand
         - Aankopen
 
-    :param portefeuille: Dataframe with portefeuille data.
+    :param holdings: Holdings with percentages.
     :param deposits: Dataframe with deposits data.
+    :param first_total: Totaal portefeuille of the first date (aantal, waarde, procent), if already known.
     :return totals: Dataframe with the respective totals.
     """
 
-    # create total of each column
-    sum_portefeuille = portefeuille.sum(axis=0)
+    # create total of each date and metric (summed over a contiguous axis, like a column sum of the wide frame)
+    sum_portefeuille = np.ascontiguousarray(holdings.cube.transpose(1, 2, 0)).sum(axis=2)
+    if first_total is not None:
+        sum_portefeuille[0] = first_total
 
     # add procent change in sum_portefeuille
-    for i in range(len(sum_portefeuille.index)):
-        if 'procent' in sum_portefeuille.index[i] and i > 3:
-            sum_portefeuille[i] = (sum_portefeuille.iloc[i - 1] - sum_portefeuille.iloc[i - 4]) / \
-                                  sum_portefeuille.iloc[i - 4]
+    sum_portefeuille[1:, 2] = (sum_portefeuille[1:, 1] - sum_portefeuille[:-1, 1]) / sum_portefeuille[:-1, 1]
 
     # calculate difference with previous date
-    difference = [sum_portefeuille.iloc[i] - sum_portefeuille.iloc[i - 3] for i in range(3, len(portefeuille.columns))]
-    difference = [0, sum_portefeuille.iloc[1], 0] + difference  # make first entry as totaal portefeuille
-
-    # add deposits
-    dates = list(set([x[:10] for x in sum_portefeuille.index.tolist()]))
-    dates = [dt.datetime.strptime(date, '%Y-%m-%d') for date in dates]
-    dates.sort()
-
-    # match to nearest date in the future
-    date_new = []
-    for index, row in deposits.iterrows():
-        diff = [(pd.Timestamp.to_pydatetime(row['Datum'])-date).days for date in dates]
-        maxmin = [i for i in diff if i <= 0]
-        try:
-            minpos = diff.index(max(maxmin))
-            date_new.append(dates[minpos])
-        except ValueError:
-            deposits.loc[index, 'Storting'] = 0
-            date_new.append(dates[-1])
-            warnings.warn('A "Stortingsdatum is after the newest export and is set to zero."', UserWarning)
-
-    deposits['Datum'] = date_new
-    deposits = deposits.groupby('Datum').sum().reset_index()
+    difference = np.zeros_like(sum_portefeuille)
+    difference[1:] = sum_portefeuille[1:] - sum_portefeuille[:-1]
+    difference[0, 1] = sum_portefeuille[0, 1]  # make first entry as totaal portefeuille
+
+    deposits = align_deposits(holdings.dates, deposits)
 
-    # map to all dates
-    deposits_full = pd.Series(0, index=sum_portefeuille.index)
-    for index, row in deposits.iterrows():
-        deposits_full.loc[deposits_full.index.str.contains(str(row['Datum'])[:10])] = row['Storting']
+    # map to all metrics of the matching date
+    deposits_full = np.zeros_like(sum_portefeuille)
+    deposits_full[holdings.dates.get_indexer(deposits['Datum'])] = deposits[['Storting']].to_numpy()
 
     # combine info
-    totals = pd.DataFrame([sum_portefeuille.values, difference, deposits_full.values],
-                          columns=portefeuille.columns,
+    totals = pd.DataFrame(np.stack([sum_portefeuille, difference, deposits_full]).reshape(3, -1),
+                          columns=holdings.labels(),
                           index=['Totaal portefeuille', 'Verschil t.o.v. vorige maand', 'Inleg'])
 
     return totals, deposits
 
 
-def calculate_winstverlies(totals):
+def align_deposits(dates: pd.DatetimeIndex, deposits: pd.DataFrame) -> pd.DataFrame:
+    """
+    Match every deposit to the nearest export date in the future and sum the deposits per export date. Deposits after
+    the newest export are set to zero.
+
+    :param dates: sorted export dates.
+    :param deposits: Dataframe with deposits data.
+    :return deposits: Dataframe with deposits per export date.
+    """
+
+    positions = np.searchsorted(dates.values, deposits['Datum'].values, side='left')
+    after_newest = positions == len(dates)
+    if after_newest.any():
+        deposits.loc[deposits.index[after_newest], 'Storting'] = 0
+        positions[after_newest] = len(dates) - 1
+        warnings.warn('A "Stortingsdatum is after the newest export and is set to zero."', UserWarning)
+
+    deposits['Datum'] = dates[positions]
+    deposits = deposits.groupby('Datum').sum().reset_index()
+
+    return deposits
+
+
+def calculate_winstverlies(totals: pd.DataFrame) -> pd.Series:
     """
     Create winstverlies Series based on portefeuille totals.
 
@@ -106,19 +104,19 @@ def calculate_winstverlies(totals):
     winstverlies = totals.loc['Verschil t.o.v. vorige maand', :] - totals.loc['Inleg', :]
 
     # fix percent numbers
-    for i in range(len(winstverlies.index)):
-        if 'procent' in winstverlies.index[i] and i > 2:
-            winstverlies[i] = winstverlies.iloc[i - 1] / totals.iloc[0, i - 4]
+    values = winstverlies.to_numpy().reshape(-1, len(metrics))
+    waarde = totals.loc['Totaal portefeuille', :].to_numpy().reshape(-1, len(metrics))[:, 1]
+    values[1:, 2] = values[1:, 1] / waarde[:-1]
 
-    return winstverlies
+    return pd.Series(values.ravel(), index=winstverlies.index)
 
 
-def split_per_year(portefeuille: pd.DataFrame, totals: pd.DataFrame, winstverlies: pd.Series) \
-        -> Tuple[dict, dict, dict]:
+def split_per_year(holdings: Holdings, totals: pd.DataFrame, winstverlies: pd.Series) -> Tuple[dict, dict, dict]:
     """
-    Change the full portefeuille, totals and winstverlies data per year.
+    Change the full portefeuille, totals and winstverlies data per year. The yearly data are views on the full data,
+    based on the year index of the export dates.
 
-    :param portefeuille: Dataframe with percentage data appended.
+    :param holdings: Holdings with percentages.
     :param totals: Dataframe with the respective totals.
     :param winstverlies: Dataframe with the respective winstverlies.
     :return portefeuille_dict: Dict with percentage data appended per year.
@@ -126,39 +124,114 @@ def split_per_year(portefeuille: pd.DataFrame, totals: pd.DataFrame, winstverlie
     :return winstverlies_dict: Dict with the respective winstverlies per year.
     """
 
-    years = sorted(list(set([year[:4] for year in list(portefeuille.columns)[2:]])))
-
     portefeuille_dict = {}
     totals_dict = {}
     winstverlies_dict = {}
-    for year in years:
-        portefeuille_dict[year] = portefeuille.loc[:, portefeuille.columns.str.contains('Product|Symbool|' + year)]. \
-            copy()
-        totals_dict[year] = totals.loc[:, totals.columns.str.contains(year)].copy()
-        winstverlies_dict[year] = winstverlies.loc[winstverlies.index.str.contains(year)].copy()
+    for year, dates in holdings.year_slices().items():
+        # contiguous column range of the year, all three are views on the full data
+        columns = slice(len(metrics) * dates.start, len(metrics) * dates.stop)
+        portefeuille_dict[year] = holdings.year_frame(dates)
+        totals_dict[year] = totals.iloc[:, columns]
+        winstverlies_dict[year] = winstverlies.iloc[columns]
 
     return portefeuille_dict, totals_dict, winstverlies_dict
 
 
-def construct_portefeuille() -> Tuple[dict, dict, dict, pd.DataFrame]:
+def construct_incremental(deposits: pd.DataFrame, path_to_portefeuille_dir: str = os.path.join('data', 'exports'),
+                          cache_dir: str = os.path.join('data', 'cache')) \
+        -> Tuple[Holdings, pd.DataFrame, pd.Series, pd.DataFrame]:
+    """
+    Construct the portefeuille from the state of the previous run. Only the new exports are read and only their dates
+    are computed, by running the regular steps on a window of the newest known date and the new dates. Everything is recomputed when
+    there is no state, when a known export or a known deposit changed or when a new export is older than the newest
+    known export. The results are stored as state for the next run.
+
+    :param deposits: Dataframe with deposits data.
+    :param path_to_portefeuille_dir: path to data folder.
+    :param cache_dir: folder with the cache of parsed exports and the state.
+    :return holdings: Holdings with percentages.
+    :return totals: Dataframe with the respective totals.
+    :return winstverlies: Series with the respective winstverlies.
+    :return deposits: Dataframe with all deposits made.
+    """
+
+    state_path = os.path.join(cache_dir, 'state.npz')
+    state = load_state(state_path)
+
+    # with a state only the new exports are read, the fingerprints of the known exports are checked all the same
+    known = {} if state is None else state['exports']
+    new_files = None if state is None else [file for file in list_filenames(path_to_portefeuille_dir, '.csv')
+                                            if file not in known]
+    exports = read_exports(path_to_portefeuille_dir, '.csv', cache_dir, export_workers, new_files)
+    fingerprints = read_fingerprints(cache_dir)
+
+    new_exports = [(file.replace('.csv', ''), data_month) for file, data_month in exports if file not in known]
+    valid = state is not None and all(fingerprints.get(file) == sha256 for file, sha256 in known.items())
+    if valid:
+        newest = state['holdings'].dates[-1]
+        valid = all(pd.Timestamp(date) > newest for date, _ in new_exports) and \
+            state['deposits_hash'] == hash_deposits(deposits[deposits['Datum'] <= newest])
+
+    if valid:
+        # compute the new dates only, the newest known date is needed for the changes with respect to it
+        n_known = len(state['holdings'].dates)
+        holdings = combine_exports(new_exports, state['holdings']) if new_exports else state['holdings']
+        window = Holdings(holdings.products, holdings.isins, holdings.dates[n_known - 1:],
+                          holdings.cube[:, n_known - 1:])
+        add_percentages(holdings=window)
+        totals_window, deposits_window = calculate_totals(
+            holdings=window, deposits=deposits[deposits['Datum'] > newest].copy(),
+            first_total=state['totals'][0, -len(metrics):]
+        )
+        winstverlies_window = calculate_winstverlies(totals=totals_window)
+
+        totals = pd.DataFrame(np.concatenate([state['totals'], totals_window.to_numpy()[:, len(metrics):]], axis=1),
+                              columns=holdings.labels(), index=totals_window.index)
+        winstverlies = pd.Series(
+            np.concatenate([state['winstverlies'], winstverlies_window.to_numpy()[len(metrics):]]),
+            index=holdings.labels()
+        )
+        deposits_all = pd.concat([state['deposits'], deposits_window]).groupby('Datum').sum().reset_index()
+    else:
+        if new_files is not None:
+            exports = read_exports(path_to_portefeuille_dir, '.csv', cache_dir, export_workers)
+        holdings = combine_exports([(file.replace('.csv', ''), data_month) for file, data_month in exports])
+        holdings = add_percentages(holdings=holdings)
+        totals, deposits_all = calculate_totals(holdings=holdings, deposits=deposits.copy())
+        winstverlies = calculate_winstverlies(totals=totals)
+
+    # store state, without the deposits after the newest export (they belong to a future export)
+    deposits_known = deposits[deposits['Datum'] <= holdings.dates[-1]]
+    save_state(
+        state_path, holdings, totals, winstverlies, align_deposits(holdings.dates, deposits_known.copy()),
+        fingerprints, hash_deposits(deposits_known)
+    )
+
+    return holdings, totals, winstverlies, deposits_all
+
+
+def construct_portefeuille(incremental: bool = incremental_construct) -> Tuple[dict, dict, dict, pd.DataFrame]:
     """
     Wrapper to construct portefeuille data. The portefeuille data is collected and a total overview is generated.
     Finally, the data is gathered in a dict per year.
 
+    :param incremental: only compute new exports, based on the state of the previous run.
     :return portefeuille_dict: Dict with percentage data appended per year.
     :return totals_dict: Dict with the respective totals per year.
     :return winstverlies_dict: Dict with the respective winstverlies per year.
     :return deposits: Dataframe with all deposits made.
     """
 
-    portefeuille = read_portefeuille()
-    portefeuille = add_percentages(portefeuille=portefeuille)
     deposits = read_deposits()
-    totals, deposits = calculate_totals(portefeuille=portefeuille, deposits=deposits)
-    winstverlies = calculate_winstverlies(totals=totals)
-    portefeuille.reset_index(inplace=True)
+    if incremental:
+        holdings, totals, winstverlies, deposits = construct_incremental(deposits=deposits)
+    else:
+        holdings = read_holdings()
+        holdings = add_percentages(holdings=holdings)
+        totals, deposits = calculate_totals(holdings=holdings, deposits=deposits)
+        winstverlies = calculate_winstverlies(totals=totals)
 
     # split data per year
-    portefeuille_dict, totals_dict, winstverlies_dict = split_per_year(portefeuille, totals, winstverlies)
+    portefeuille_dict, totals_dict, winstverlies_dict = split_per_year(holdings, totals, winstverlies)
 
     return portefeuille_dict, totals_dict, winstverlies_dict, deposits
@@ -1,14 +1,39 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
 from oauth2client.service_account import ServiceAccountCredentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 
+from settings import gsheet_chunk_size
 
-def copy_to_gsheet(excel_output, folder_id):
+
+def workbook_hash(excel_output: str) -> str:
     """
-    Copy file from excel_output path to a folder in Google Drive. If the file already exists, it will be overwritten.
+    Hash the contents of an Excel file. The creation time in docProps/core.xml and the timestamps in the zip are left
+    out, so a workbook with the same contents gives the same hash every time it is written.
 
     :param excel_output: String with path to where excel file is stored.
-    :param folder_id: Id from Google drive folder to where the file needs to be stored.
+    :return: String with the sha256 hex digest.
+    """
+
+    sha = hashlib.sha256()
+    with zipfile.ZipFile(excel_output) as workbook:
+        for name in sorted(workbook.namelist()):
+            if name == 'docProps/core.xml':
+                continue
+            sha.update(name.encode() + b'\0')
+            sha.update(workbook.read(name))
+
+    return sha.hexdigest()
+
+
+def build_drive_service():
+    """
+    :return: Google Drive API client, authenticated with the service account in keyfile.json.
     """
 
     scope = [
@@ -16,43 +41,111 @@ def copy_to_gsheet(excel_output, folder_id):
         "https://www.googleapis.com/auth/drive"
     ]
     creds = ServiceAccountCredentials.from_json_keyfile_name('keyfile.json', scope)
-    file_name = excel_output.split("\\")[-1].replace('.xlsx', '')
 
-    # build the Google Drive API client
-    drive_service = build('drive', 'v3', credentials=creds)
-
-    existing_id = drive_service.files().list(
-        q=f"name contains '{file_name}' and '{folder_id}' in parents",
-        spaces='drive',
-        fields='files(id, name)',
-        supportsAllDrives=True,
-        includeItemsFromAllDrives=True
-    ).execute()
-    items = existing_id.get('files', [])
+    return build('drive', 'v3', credentials=creds)
+
+
+def upload_media(excel_output: str) -> MediaFileUpload:
+    """
+    :param excel_output: String with path to where excel file is stored.
+    :return: resumable upload of the Excel file, in chunks of gsheet_chunk_size bytes.
+    """
 
-    media = MediaFileUpload(
+    return MediaFileUpload(
         excel_output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        chunksize=gsheet_chunk_size,
+        resumable=True
     )
 
-    if items:
-        # overwrite existing file
-        file_id = items[0]['id']
-        drive_service.files().update(
-            fileId=file_id,
-            media_body=media
-        ).execute()
-    else:
-        # create new file
-        file_metadata = {
-            'name': f'{file_name}',
-            'mimeType': 'application/vnd.google-apps.spreadsheet',
-            'parents': [folder_id],
-        }
-
-        # Upload the file and convert to Google Sheets
-        drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id'
+
+def update_file(drive_service, file_id: str, excel_output: str):
+    """
+    Overwrite a file in Google Drive.
+
+    :param drive_service: Google Drive API client.
+    :param file_id: Id of the Google Drive file.
+    :param excel_output: String with path to where excel file is stored.
+    """
+
+    drive_service.files().update(
+        fileId=file_id,
+        media_body=upload_media(excel_output)
+    ).execute()
+
+
+def copy_to_gsheet(excel_output, folder_id, drive_service=None, state_path=None):
+    """
+    Copy file from excel_output path to a folder in Google Drive. If the file already exists, it will be overwritten.
+    The hash of the uploaded workbook is stored in state_path, and the upload is skipped if the workbook did not change
+    since. If the file of the last upload no longer exists, the file is looked up in the folder again. Large files are
+    uploaded in chunks of gsheet_chunk_size bytes, so a failed chunk can be resumed.
+
+    :param excel_output: String with path to where excel file is stored.
+    :param folder_id: Id from Google drive folder to where the file needs to be stored.
+    :param drive_service: Google Drive API client, built from keyfile.json by default, see perf/fake_drive_service.py.
+    :param state_path: path of the stored hash and file id of the last upload, in data/cache/gsheet by default.
+    """
+
+    file_name = excel_output.split("\\")[-1].replace('.xlsx', '')
+    if state_path is None:
+        state_path = os.path.join('data', 'cache', 'gsheet', f'{folder_id}_{os.path.basename(file_name)}.json')
+
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    content_hash = workbook_hash(excel_output)
+    if state.get('hash') == content_hash:
+        logging.info('Excel file did not change since the last upload, skip copy to gsheet')
+        return
+
+    # build the Google Drive API client
+    drive_service = build_drive_service() if drive_service is None else drive_service
+
+    file_id = state.get('file_id')
+    if file_id is not None:
+        try:
+            # overwrite the file of the last upload
+            update_file(drive_service, file_id, excel_output)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logging.warning('Stored Google Drive file ' + file_id + ' not found, look it up in the folder again')
+            file_id = None
+
+    if file_id is None:
+        existing_id = drive_service.files().list(
+            q=f"name contains '{file_name}' and '{folder_id}' in parents",
+            spaces='drive',
+            fields='files(id, name)',
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
         ).execute()
+        items = existing_id.get('files', [])
+
+        if items:
+            # overwrite existing file
+            file_id = items[0]['id']
+            update_file(drive_service, file_id, excel_output)
+        else:
+            # create new file
+            file_metadata = {
+                'name': f'{file_name}',
+                'mimeType': 'application/vnd.google-apps.spreadsheet',
+                'parents': [folder_id],
+            }
+
+            # Upload the file and convert to Google Sheets
+            file_id = drive_service.files().create(
+                body=file_metadata,
+                media_body=upload_media(excel_output),
+                fields='id'
+            ).execute()['id']
+
+    # only stored once the upload succeeded
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump({'hash': content_hash, 'file_id': file_id}, f)
+    os.replace(state_path + '.tmp', state_path)
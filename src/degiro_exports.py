@@ -1,19 +1,29 @@
 from playwright.sync_api import sync_playwright
 import pyotp
+import json
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime as dt
 
+from settings import degiro_base_url, degiro_int_account, degiro_headless, degiro_workers
 
-def login_degiro(p):
+
+def login_degiro(p, headless: bool = degiro_headless):
     """
     Login to DEGIRO page.
     """
 
-    browser = p.chromium.launch(headless=False)
-    context = browser.new_context(accept_downloads=True)
+    browser = p.chromium.launch(headless=headless)
+    context = browser.new_context()
     page = context.new_page()
 
-    page.goto("https://trader.degiro.nl/login")
+    page.goto(degiro_base_url + "login")
 
     try:
         page.click('button:has-text("Alles accepteren")')
@@ -37,59 +47,262 @@ def login_degiro(p):
     return page, context
 
 
-def get_session_id(page, context):
+def get_session_id(page, context, timeout: float = 30):
     """
-    Get session id to make exports later.
+    Get session id to make exports later. Waits until the session cookie is set, at most timeout seconds.
     """
 
-    page.goto('https://trader.degiro.nl/trader/#/portfolio/assets')
-    page.wait_for_timeout(500)
-    cookies = context.cookies()
+    page.goto(degiro_base_url + 'trader/#/portfolio/assets')
 
     # Find session ID in cookies
-    session_id = None
-    for cookie in cookies:
-        if cookie['name'] == 'JSESSIONID':
-            session_id = cookie['value']
-            break
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for cookie in context.cookies():
+            if cookie['name'] == 'JSESSIONID':
+                return cookie['value']
+        page.wait_for_timeout(100)
 
-    return session_id
+    return None
 
 
-def make_export(page, export_link: str, output_path: str):
+def session_state_path() -> str:
     """
-    Make export based on export link and destination folder.
+    :return: path of the stored browser state of the DEGIRO login, one per account.
     """
 
-    with page.expect_download() as download_info:
-        try:
-            page.goto(export_link)
-        except:
-            download = download_info.value
-            # Save the downloaded file
-            download.save_as(output_path)
-    page.wait_for_timeout(6000)
+    login = os.environ.get('degiro-login')
+    if not login:
+        raise RuntimeError('degiro-login is not set, add the DEGIRO username to the environment or .env.')
 
+    return os.path.join('data', 'cache', 'degiro', login + '.json')
 
-def update_exports_degiro():
+
+def is_session_valid(session_id: str, timeout: float = 10) -> bool:
+    """
+    Check if a session id is still logged in.
+
+    :param session_id: String with the JSESSIONID of a login.
+    :param timeout: seconds to wait for a connection and for the response.
+    :return: True if the session is valid.
+    """
+
+    try:
+        response = requests.get(
+            degiro_base_url + 'login/secure/config', cookies={'JSESSIONID': session_id}, timeout=timeout
+        )
+    except requests.RequestException:
+        return False
+
+    return response.ok
+
+
+def get_degiro_session_id(state_path: str = None) -> str:
     """
-    Update export folder DEGIRO. This will update the (current) portfolio and rekeningoverzicht (Account)
+    Get a logged in session id. The browser state (cookies) of a login is stored in state_path, and its session is
+    reused while it is valid. Only when it expired, the browser logs in again.
+
+    :param state_path: path of the stored browser state, per account in data/cache/degiro by default.
+    :return: String with the JSESSIONID.
     """
 
+    state_path = session_state_path() if state_path is None else state_path
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            cookies = json.load(f)['cookies']
+        session_id = next((cookie['value'] for cookie in cookies if cookie['name'] == 'JSESSIONID'), None)
+        if session_id is not None and is_session_valid(session_id):
+            return session_id
+
+    # the browser is only needed to login, the reports are downloaded directly
     with sync_playwright() as p:
         page, context = login_degiro(p)
-        page.wait_for_timeout(500)
         session_id = get_session_id(page, context)
-        page.wait_for_timeout(500)
-        date = dt.now().date()
+        if session_id is not None:
+            os.makedirs(os.path.dirname(state_path), exist_ok=True)
+            # the state holds the session cookie, so the file is only readable by the user from the start
+            fd = os.open(state_path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(context.storage_state(), f)
+            os.replace(state_path + '.tmp', state_path)
+        context.browser.close()
+    if session_id is None:
+        raise RuntimeError('Login to DEGIRO failed, no session id found.')
+
+    return session_id
+
+
+def create_session(session_id: str, pool_size: int = degiro_workers, retries: int = 3) -> requests.Session:
+    """
+    Create a http session to download reports with, authenticated with the session id of the login. Connection errors,
+    429 and 5xx responses are retried with exponential backoff.
+
+    :param session_id: String with the JSESSIONID of the login.
+    :param pool_size: number of connections to keep open for concurrent downloads.
+    :param retries: number of retries per request.
+    :return: requests Session object.
+    """
+
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_maxsize=pool_size, max_retries=retry))
+    session.mount('http://', HTTPAdapter(pool_maxsize=pool_size, max_retries=retry))
+    session.cookies.set('JSESSIONID', session_id)
+    session.params = {'intAccount': degiro_int_account, 'sessionId': session_id, 'country': 'NL', 'lang': 'nl'}
+
+    return session
+
+
+def format_date(date) -> str:
+    """
+    :param date: date to format.
+    :return: String with the date as used in report requests, e.g. 01/12/2020.
+    """
+
+    return f'{date.day:02}/{date.month:02}/{date.year}'
+
+
+def fetch_report(session: requests.Session, report: str, params: dict, timeout: float = 60) -> bytes:
+    """
+    Fetch a csv report.
+
+    :param session: requests Session object from create_session.
+    :param report: name of the report, 'positionReport' or 'cashAccountReport'.
+    :param params: Dict with the query parameters of the report, e.g. toDate.
+    :param timeout: seconds to wait for a connection and for the response.
+    :return: contents of the report.
+    """
+
+    response = session.get(
+        degiro_base_url + 'portfolio-reports/secure/v3/' + report + '/csv', params=params, timeout=timeout
+    )
+    response.raise_for_status()
+
+    return response.content
+
+
+def write_report(content: bytes, output_path: str):
+    """
+    Write a report. The file is replaced at once, so it is never half written.
 
-        make_export(
-            page=page,
-            export_link=f"https://trader.degiro.nl/portfolio-reports/secure/v3/positionReport/csv?intAccount=1218922&sessionId={session_id}&country=NL&lang=nl&toDate=01%2F{date.month:02}%2F{date.year}",
-            output_path=os.path.join(os.getcwd(), 'data', 'exports', f'{dt.now().date().replace(day=1)}.csv')
+    :param content: contents of the report.
+    :param output_path: path to write the report to.
+    """
+
+    with open(output_path + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(output_path + '.tmp', output_path)
+
+
+def download_report(session: requests.Session, report: str, params: dict, output_path: str, timeout: float = 60):
+    """
+    Download a csv report. The file is only written once it is downloaded completely.
+
+    :param session: requests Session object from create_session.
+    :param report: name of the report, 'positionReport' or 'cashAccountReport'.
+    :param params: Dict with the query parameters of the report, e.g. toDate.
+    :param output_path: path to write the report to.
+    :param timeout: seconds to wait for a connection and for the response.
+    """
+
+    write_report(fetch_report(session, report, params, timeout), output_path)
+
+
+def update_account_report(session: requests.Session, output_path: str, date):
+    """
+    Update the rekeningoverzicht (Account.csv). Only the days from the last date in the existing file up to date are
+    downloaded. The rows of that last date are replaced by the downloaded ones, as the day may not have been complete.
+
+    :param session: requests Session object from create_session.
+    :param output_path: path of the rekeningoverzicht.
+    :param date: last date to download.
+    """
+
+    lines = []
+    if os.path.exists(output_path):
+        with open(output_path, 'rb') as f:
+            lines = [line for line in f.read().splitlines(keepends=True) if line.strip()]
+    if len(lines) < 2:
+        # no existing rows (or not even a header), download the full history
+        download_report(
+            session, 'cashAccountReport', {'fromDate': '27/05/1990', 'toDate': format_date(date)}, output_path
         )
-        make_export(
-            page=page,
-            export_link=f"https://trader.degiro.nl/portfolio-reports/secure/v3/cashAccountReport/csv?intAccount=1218922&sessionId={session_id}&country=NL&lang=nl&fromDate=27%2F05%2F1990&toDate={date.day:02}%2F{date.month:02}%2F{date.year}",
-            output_path=os.path.join(os.getcwd(), 'data', 'deposits', 'Account.csv')
+        return
+
+    header, *rows = lines
+    dates = [dt.strptime(row.split(b',', 1)[0].decode(), '%d-%m-%Y').date() for row in rows]
+    from_date = max(dates)
+    new = fetch_report(session, 'cashAccountReport', {'fromDate': format_date(from_date), 'toDate': format_date(date)})
+
+    # newest rows first, as in the report
+    newline = header[len(header.rstrip(b'\r\n')):] or b'\n'
+    new_rows = [line.rstrip(b'\r\n') + newline for line in new.splitlines()[1:] if line.strip()]
+    old_rows = [row.rstrip(b'\r\n') + newline for row, row_date in zip(rows, dates) if row_date < from_date]
+    write_report(header + b''.join(new_rows + old_rows), output_path)
+
+
+def update_exports_degiro():
+    """
+    Update export folder DEGIRO. This will update the (current) portfolio and rekeningoverzicht (Account). The export
+    of the current month is only downloaded if it does not exist yet.
+    """
+
+    session = create_session(get_degiro_session_id())
+    date = dt.now().date()
+
+    export_path = os.path.join(os.getcwd(), 'data', 'exports', f'{date.replace(day=1)}.csv')
+    if not os.path.exists(export_path):
+        download_report(session, 'positionReport', {'toDate': format_date(date.replace(day=1))}, export_path)
+    update_account_report(session, os.path.join(os.getcwd(), 'data', 'deposits', 'Account.csv'), date)
+
+
+def missing_export_dates(path_to_exports: str, date, start=None) -> list:
+    """
+    Find the months without export, from the first export (or start) up to date. A month has an export if any file
+    of that month exists, whatever its day. Files that are not named after a date are ignored.
+
+    :param path_to_exports: folder with the exports, named '<%Y-%m-%d>.csv'.
+    :param date: last date to check.
+    :param start: first date to check, the date of the first export by default.
+    :return: List with the first day of every month without export.
+    """
+
+    exports = []
+    for file in os.listdir(path_to_exports):
+        try:
+            exports.append(dt.strptime(file, '%Y-%m-%d.csv').date())
+        except ValueError:
+            continue
+    months_exported = {(export.year, export.month) for export in exports}
+    if start is None:
+        if not exports:
+            return []
+        start = min(exports)
+
+    months = pd.date_range(start=pd.Timestamp(start).replace(day=1), end=date, freq='MS')
+    return [month.date() for month in months if (month.year, month.month) not in months_exported]
+
+
+def backfill_exports_degiro(n_workers: int = degiro_workers, start=None):
+    """
+    Download the exports of all months that are missing in the export folder DEGIRO. The exports are downloaded
+    concurrently by n_workers threads over one logged in session.
+
+    :param n_workers: number of concurrent downloads.
+    :param start: first month to download, the month of the first export by default.
+    """
+
+    path_to_exports = os.path.join(os.getcwd(), 'data', 'exports')
+    months = missing_export_dates(path_to_exports, dt.now().date(), start)
+    if not months:
+        return
+
+    logging.info('Backfill ' + str(len(months)) + ' missing exports')
+    session = create_session(get_degiro_session_id(), pool_size=n_workers)
+
+    def download(month):
+        download_report(
+            session, 'positionReport', {'toDate': format_date(month)}, os.path.join(path_to_exports, f'{month}.csv')
         )
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(download, months))
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+metrics = ['aantal', 'waarde', 'procent']
+
+
+class Holdings:
+    """
+    Holdings of the portefeuille over time, stored as a dense cube of positions x dates x metrics (aantal, waarde,
+    procent). Positions and dates are integer indexed. Wide dataframes with '<date> (<metric>)' columns are only
+    rendered from the cube for output.
+    """
+
+    def __init__(self, products: np.ndarray, isins: np.ndarray, dates: pd.DatetimeIndex, cube: np.ndarray):
+        """
+        :param products: product name per position.
+        :param isins: Symbool/ISIN per position, nan for cash positions.
+        :param dates: sorted export dates.
+        :param cube: float array of shape (positions, dates, metrics).
+        """
+
+        self.products = np.asarray(products, dtype=object)
+        self.isins = np.asarray(isins, dtype=object)
+        self.dates = pd.DatetimeIndex(dates)
+        self.cube = cube
+
+    def keys(self) -> np.ndarray:
+        """
+        Identity of every position: the Symbool/ISIN, or the product name for cash positions without ISIN.
+
+        :return: array with a unique key per position.
+        """
+
+        isins = pd.Series(self.isins, dtype=object)
+        return isins.fillna('\x00' + pd.Series(self.products, dtype=object)).to_numpy()
+
+    @property
+    def aantal(self) -> np.ndarray:
+        return self.cube[:, :, 0]
+
+    @property
+    def waarde(self) -> np.ndarray:
+        return self.cube[:, :, 1]
+
+    @property
+    def procent(self) -> np.ndarray:
+        return self.cube[:, :, 2]
+
+    def labels(self, metric_names: list = None, dates: slice = slice(None)) -> list:
+        """
+        Render the wide column labels, i.e. '<date> (<metric>)' for every date and metric.
+
+        :param metric_names: metrics to render, all metrics by default.
+        :param dates: slice of the date axis to render, all dates by default.
+        :return: list of column labels in date order.
+        """
+
+        metric_names = metrics if metric_names is None else metric_names
+        return [
+            date + ' (' + metric + ')' for date in self.dates[dates].strftime('%Y-%m-%d') for metric in metric_names
+        ]
+
+    def year_slices(self) -> dict:
+        """
+        Index the date axis per year. As the dates are sorted, every year is a contiguous slice of the date axis.
+
+        :return: dict with a slice of the date axis per year (as string), in date order.
+        """
+
+        years = self.dates.year.to_numpy()
+        starts = np.flatnonzero(np.diff(years, prepend=-1))
+        stops = np.append(starts[1:], len(years))
+        return {str(years[start]): slice(start, stop) for start, stop in zip(starts, stops)}
+
+    def year_frame(self, dates: slice) -> pd.DataFrame:
+        """
+        Render a slice of the date axis as wide dataframe with Product and Symbool/ISIN columns. The values are a view
+        on the cube, nothing is copied.
+
+        :param dates: slice of the date axis, e.g. from year_slices.
+        :return portefeuille: Dataframe with Product, Symbool/ISIN and a column per date and metric.
+        """
+
+        portefeuille = pd.DataFrame(
+            self.cube[:, dates].reshape(len(self.products), -1), columns=self.labels(dates=dates), copy=False
+        )
+        portefeuille.insert(0, 'Product', self._render_products())
+        portefeuille.insert(1, 'Symbool/ISIN', self.isins)
+
+        return portefeuille
+
+    def _render_products(self) -> np.ndarray:
+        """
+        :return: product names as shown in the output, with the cash position shown as 'VRIJE RUIMTE'.
+        """
+
+        products = pd.Series(self.products, dtype=object)
+        return products.replace('CASH & CASH FUND & FTX CASH(EUR)', 'VRIJE RUIMTE').to_numpy()
+
+    def to_frame(self, metric_names: list = None) -> pd.DataFrame:
+        """
+        Render the holdings as wide dataframe, indexed on Product and Symbool/ISIN.
+
+        :param metric_names: metrics to render, all metrics by default.
+        :return portefeuille: Dataframe with a column per date and metric.
+        """
+
+        metric_names = metrics if metric_names is None else metric_names
+        values = self.cube if metric_names == metrics else \
+            self.cube[:, :, [metrics.index(metric) for metric in metric_names]]
+
+        return pd.DataFrame(
+            values.reshape(len(self.products), -1),
+            index=pd.MultiIndex.from_arrays([self._render_products(), self.isins], names=['Product', 'Symbool/ISIN']),
+            columns=self.labels(metric_names)
+        )
@@ -1,9 +1,352 @@
 import json
+import logging
+import math
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 
 import pandas as pd
 import requests
 from progressbar import progressbar
+from requests.adapters import HTTPAdapter
+
+from src.write_output import write_frame
+from settings import rapidapi_workers, rapidapi_rate, rapidapi_cache_ttl, rapidapi_cache_max_stale, \
+    rapidapi_cache_only, rapidapi_base_url, rapidapi_timeout, rapidapi_retries
+
+
+class TokenBucket:
+    """
+    Rate limiter for requests from multiple threads. The bucket holds up to capacity tokens and is refilled with rate
+    tokens per second, every request takes one token.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        """
+        :param rate: number of requests per second.
+        :param capacity: number of requests that can be done at once, after a quiet period.
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waits until one is available.
+        """
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RapidApiClient:
+    """
+    Client for the morning-star API. All requests share one pooled session and a rate limiter. Connection errors,
+    timeouts, 429 and 5xx responses are retried with exponential backoff and jitter, or after the Retry-After time if
+    the API sends one. The client keeps counters of the requests, retries, latency and remaining quota.
+    """
+
+    latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf')]
+
+    def __init__(self, base_url: str = rapidapi_base_url, rate: float = rapidapi_rate,
+                 n_workers: int = rapidapi_workers, timeout: float = rapidapi_timeout,
+                 max_retries: int = rapidapi_retries, backoff: float = 0.5):
+        """
+        :param base_url: url of the API, e.g. of a local stub server for testing.
+        :param rate: maximum number of requests per second.
+        :param n_workers: number of threads that use the client, to size the connection pool.
+        :param timeout: seconds to wait for a connection and for a response.
+        :param max_retries: number of retries of a failed request.
+        :param backoff: seconds to wait at most before the first retry, doubled for every next retry.
+        """
+
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = TokenBucket(rate)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=n_workers))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=n_workers))
+
+        self.lock = threading.Lock()
+        self.metrics = {
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'latency': dict.fromkeys(self.latency_buckets, 0),
+            'remaining': None
+        }
+
+    def get_json(self, endpoint: str, params: dict):
+        """
+        Request an endpoint of the API, respecting the rate limit of the plan.
+
+        :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+        :param params: Dict with the query parameters.
+        :return: decoded json response.
+        """
+
+        headers = {
+            'x-rapidapi-key': os.environ.get('x-rapidapi-key'),
+            'x-rapidapi-host': "morning-star.p.rapidapi.com"
+        }
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(
+                    self.base_url + endpoint, headers=headers, params=params, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                self.count(time.monotonic() - start)
+                if attempt == self.max_retries:
+                    self.count_failure()
+                    raise
+                self.retry(attempt)
+                continue
+
+            self.count(time.monotonic() - start, response)
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == self.max_retries:
+                    self.count_failure()
+                    response.raise_for_status()
+                self.retry(attempt, response.headers.get('Retry-After'))
+                continue
+
+            if not response.ok:
+                self.count_failure()
+            response.raise_for_status()
+            return response.json()
+
+    def retry(self, attempt: int, retry_after: str = None):
+        """
+        Wait before the next attempt of a request.
+
+        :param attempt: number of the failed attempt, starting at 0.
+        :param retry_after: value of the Retry-After header, seconds or a http date. Invalid values are ignored, and
+            the wait is at most timeout * max_retries seconds.
+        """
+
+        with self.lock:
+            self.metrics['retries'] += 1
+
+        wait = random.uniform(0, self.backoff * 2 ** attempt)
+        if retry_after is not None:
+            try:
+                server_wait = float(retry_after)
+            except ValueError:
+                try:
+                    server_wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError, IndexError):
+                    server_wait = float('nan')
+            if not math.isnan(server_wait):
+                wait = server_wait
+        time.sleep(min(max(wait, 0), self.timeout * self.max_retries))
+
+    def count(self, latency: float, response: requests.Response = None):
+        """
+        Count a request in the metrics.
+
+        :param latency: seconds the request took.
+        :param response: response of the request, None if it failed.
+        """
+
+        with self.lock:
+            self.metrics['requests'] += 1
+            bucket = next(bucket for bucket in self.latency_buckets if latency <= bucket)
+            self.metrics['latency'][bucket] += 1
+            if response is not None and 'X-RateLimit-Requests-Remaining' in response.headers:
+                self.metrics['remaining'] = int(response.headers['X-RateLimit-Requests-Remaining'])
+
+    def count_failure(self):
+        """
+        Count a request that failed after all retries in the metrics.
+        """
+
+        with self.lock:
+            self.metrics['failures'] += 1
+
+    def summary(self) -> str:
+        """
+        :return: String with the metrics of the client.
+        """
+
+        latency = ', '.join(
+            '<=' + str(bucket) + 's: ' + str(n) for bucket, n in self.metrics['latency'].items() if n > 0
+        )
+        return (
+            str(self.metrics['requests']) + ' requests, ' + str(self.metrics['retries']) + ' retries, ' +
+            str(self.metrics['failures']) + ' failures, remaining quota ' + str(self.metrics['remaining']) +
+            ', latency ' + (latency if latency else '-')
+        )
+
+
+# the fetch threads of get_stock_fundamentals and the revalidation threads of the response cache share the client
+client = RapidApiClient(n_workers=2 * rapidapi_workers)
+
+
+def fetch_json(endpoint: str, params: dict):
+    """
+    Request an endpoint of the morning-star API with the shared client.
+
+    :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+    :param params: Dict with the query parameters.
+    :return: decoded json response.
+    """
+
+    return client.get_json(endpoint, params)
+
+
+class ResponseCache:
+    """
+    On-disk cache of API responses, one json file per endpoint and query. Every endpoint has its own time to live. An
+    expired response is still returned while it is fetched again in the background (stale-while-revalidate), up to a
+    maximum age per endpoint. Only missing responses and responses past their maximum age have to be waited for.
+    """
+
+    def __init__(self, path: str, ttl: dict, max_stale: dict = None, cache_only: bool = False,
+                 n_workers: int = rapidapi_workers):
+        """
+        :param path: folder to store the responses in.
+        :param ttl: Dict with the time to live in seconds per endpoint, endpoints that are not in it are not cached.
+        :param max_stale: Dict with the maximum age in seconds per endpoint of an expired response that is still
+            returned, the time to live by default.
+        :param cache_only: only return cached responses, expired or not, and never request the API.
+        :param n_workers: number of threads to revalidate expired responses with.
+        """
+
+        self.path = path
+        self.ttl = ttl
+        self.max_stale = {} if max_stale is None else max_stale
+        self.cache_only = cache_only
+        self.n_workers = n_workers
+        self.revalidating = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def file(self, endpoint: str, params: dict) -> str:
+        """
+        :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+        :param params: Dict with the query parameters.
+        :return: path of the cached response.
+        """
+
+        query = '_'.join(str(value) for _, value in sorted(params.items()))
+        return os.path.join(self.path, endpoint.replace('/', '_'), query + '.json')
+
+    def get(self, endpoint: str, params: dict, fetch=fetch_json):
+        """
+        Get a response from the cache, or fetch it if it is not cached.
+
+        :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+        :param params: Dict with the query parameters.
+        :param fetch: function to request the API with.
+        :return: decoded json response.
+        """
+
+        path = self.file(endpoint, params)
+        if os.path.exists(path):
+            with open(path) as f:
+                cached = json.load(f)
+            age = time.time() - cached['fetched']
+            ttl = self.ttl.get(endpoint, 0)
+            if self.cache_only or age <= ttl:
+                return cached['response']
+            if age <= max(self.max_stale.get(endpoint, ttl), ttl):
+                self.revalidate(endpoint, params, fetch)
+                return cached['response']
+            return self.fetch(endpoint, params, fetch)
+
+        if self.cache_only:
+            raise LookupError('No cached response of ' + endpoint + ' for ' + str(params) + ' in cache only mode.')
+
+        return self.fetch(endpoint, params, fetch)
+
+    def fetch(self, endpoint: str, params: dict, fetch=fetch_json):
+        """
+        Request the API and store the response in the cache.
+
+        :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+        :param params: Dict with the query parameters.
+        :param fetch: function to request the API with.
+        :return: decoded json response.
+        """
+
+        response = fetch(endpoint, params)
+        if endpoint in self.ttl:
+            path = self.file(endpoint, params)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.' + str(threading.get_ident()) + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'fetched': time.time(), 'response': response}, f)
+            os.replace(tmp, path)
+
+        return response
+
+    def revalidate(self, endpoint: str, params: dict, fetch=fetch_json):
+        """
+        Fetch an expired response again in the background, once per response.
+
+        :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+        :param params: Dict with the query parameters.
+        :param fetch: function to request the API with.
+        """
+
+        path = self.file(endpoint, params)
+        with self.lock:
+            if path in self.revalidating:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.n_workers)
+            self.revalidating[path] = self.executor.submit(self.fetch, endpoint, params, fetch)
+
+    def wait(self):
+        """
+        Wait for the background revalidations, once at shutdown so the requests do not wait for them. A revalidation
+        that fails keeps the expired response in the cache.
+        """
+
+        with self.lock:
+            futures = list(self.revalidating.values())
+            self.revalidating = {}
+        for future in futures:
+            try:
+                future.result()
+            except (requests.RequestException, ValueError) as e:
+                logging.warning('Revalidation failed, keeping the cached response: ' + str(e))
+
+
+response_cache = ResponseCache(
+    os.path.join('data', 'cache', 'rapidapi'), rapidapi_cache_ttl, rapidapi_cache_max_stale, rapidapi_cache_only
+)
+
+
+def get_json(endpoint: str, params: dict):
+    """
+    Get the response of an endpoint of the morning-star API, from the response cache if possible.
+
+    :param endpoint: path of the endpoint, e.g. 'stock/get-detail'.
+    :param params: Dict with the query parameters.
+    :return: decoded json response.
+    """
+
+    return response_cache.get(endpoint, params)
 
 
 def get_stock_get_detail(performance_id: str):
@@ -14,16 +357,7 @@ def get_stock_get_detail(performance_id: str):
     :return res: Dict with results.
     """
 
-    url = "https://morning-star.p.rapidapi.com/stock/get-detail"
-    querystring = {"PerformanceId": performance_id}
-
-    headers = {
-        'x-rapidapi-key': os.environ.get('x-rapidapi-key'),
-        'x-rapidapi-host': "morning-star.p.rapidapi.com"
-    }
-
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    response = json.loads(response.text)[0]
+    response = get_json('stock/get-detail', {"PerformanceId": performance_id})[0]
 
     # to fix 0 dividend
     try:
@@ -63,16 +397,7 @@ def get_stock_v2_get_competitors(performance_id: str):
     :return res: Dict with results.
     """
 
-    url = "https://morning-star.p.rapidapi.com/stock/v2/get-competitors"
-    querystring = {"performanceId": performance_id}
-
-    headers = {
-        'x-rapidapi-key': os.environ.get('x-rapidapi-key'),
-        'x-rapidapi-host': "morning-star.p.rapidapi.com"
-    }
-
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    response = json.loads(response.text)
+    response = get_json('stock/v2/get-competitors', {"performanceId": performance_id})
 
     res = {
         'PriceEarnings': response['main']['priceEarnings'],
@@ -91,16 +416,7 @@ def get_stock_v2_get_key_stats(performance_id: str):
     :return res: Dict with results.
     """
 
-    url = "https://morning-star.p.rapidapi.com/stock/v2/get-key-stats"
-    querystring = {"performanceId": performance_id}
-
-    headers = {
-        'x-rapidapi-key': os.environ.get('x-rapidapi-key'),
-        'x-rapidapi-host': "morning-star.p.rapidapi.com"
-    }
-
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    response = json.loads(response.text)
+    response = get_json('stock/v2/get-key-stats', {"performanceId": performance_id})
 
     res = {
         'Revenue3YearGrowth': response['revenue3YearGrowth']['stockValue'],
@@ -122,19 +438,7 @@ def get_stock_v2_get_realtime_data(performance_id: str):
     :return res: Dict with results.
     """
 
-    url = "https://morning-star.p.rapidapi.com/stock/v2/get-realtime-data"
-    querystring = {"performanceId": performance_id}
-
-    headers = {
-        'x-rapidapi-key': os.environ.get('x-rapidapi-key'),
-        'x-rapidapi-host': "morning-star.p.rapidapi.com"
-    }
-
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    try:
-        response = json.loads(response.text)
-    except:
-        print(response.text)
+    response = get_json('stock/v2/get-realtime-data', {"performanceId": performance_id})
 
     res = {
         'LastPrice': response['lastPrice'],
@@ -147,11 +451,41 @@ def get_stock_v2_get_realtime_data(performance_id: str):
     return res
 
 
-def create_stock_overview(writer: pd.ExcelWriter, stocks_dict: dict, portefeuille_dict: dict):
+def get_stock_fundamentals(performance_ids: list, n_workers: int = rapidapi_workers) -> list:
+    """
+    Retrieve the fundamentals of stocks from all endpoints. The requests are done concurrently by n_workers threads,
+    limited by the rate limiter.
+
+    :param performance_ids: List with performance IDs.
+    :param n_workers: number of concurrent requests.
+    :return res: List with a Dict with results per performance ID, in the order of performance_ids.
+    """
+
+    getters = [get_stock_get_detail, get_stock_v2_get_competitors, get_stock_v2_get_key_stats,
+               get_stock_v2_get_realtime_data]
+    jobs = [(getter, performance_id) for performance_id in performance_ids for getter in getters]
+
+    # map keeps the order of the jobs
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(progressbar(executor.map(lambda job: job[0](job[1]), jobs), max_value=len(jobs)))
+    logging.info('rapid-api: ' + client.summary())
+
+    res = []
+    for i in range(len(performance_ids)):
+        tmp = {}
+        for result in results[i * len(getters):(i + 1) * len(getters)]:
+            tmp.update(result)
+        res.append(tmp)
+
+    return res
+
+
+def create_stock_overview(writer: pd.ExcelWriter, formats: dict, stocks_dict: dict, portefeuille_dict: dict):
     """
     Create sheet with stock overview with stock fundamentals.
 
     :param writer: ExcelWriter object to write the sheet to.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :param stocks_dict: Dict with the performanceIDs to retrieve information from.
     :param portefeuille_dict: Dict with portefeuille.
     :return res: Dict with results.
@@ -164,20 +498,15 @@ def create_stock_overview(writer: pd.ExcelWriter, stocks_dict: dict, portefeuill
     all_holdings = last_year[last_year.iloc[:, -3] > 0]['Product']
 
     if all(key in stocks_dict for key in set(all_holdings)):
-        res = []
-        for key, value in progressbar(stocks_dict.items()):
-            if key in set(all_holdings) and value is not None:
-                # get all dict results
-                tmp = {'Holding': key}
-                tmp.update(get_stock_get_detail(value))
-                tmp.update(get_stock_v2_get_competitors(value))
-                tmp.update(get_stock_v2_get_key_stats(value))
-                tmp.update(get_stock_v2_get_realtime_data(value))
-                res.append(tmp)
+        holdings = [
+            (key, value) for key, value in stocks_dict.items() if key in set(all_holdings) and value is not None
+        ]
+        fundamentals = get_stock_fundamentals([value for _, value in holdings])
+        res = [{'Holding': key, **result} for (key, _), result in zip(holdings, fundamentals)]
 
         # get dict to DF and write to Excel
         res = pd.DataFrame.from_dict(res)
-        res.to_excel(writer, sheet_name, index=False)
+        write_frame(writer, formats, res, sheet_name, index=False)
     else:
         # some stocks info is missing, print which
         missings = [holding for holding in all_holdings if holding not in stocks_dict]
@@ -1,10 +1,78 @@
+import hashlib
+import json
 import os
-from functools import reduce
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from os import listdir
 
+import numpy as np
 import pandas as pd
 
-from settings import rekeningoverzicht_filename
+from settings import rekeningoverzicht_filename, export_workers
+from src.holdings import Holdings, metrics
+
+ledger_categories = ['deposit', 'dividend', 'dividend tax', 'cost', 'other']
+ledger_dtypes = {
+    'Tijd': str, 'Valutadatum': str, 'Product': str, 'ISIN': str, 'Omschrijving': str, 'FX': str, 'Mutatie': str,
+    'Unnamed: 8': float, 'Saldo': str, 'Order Id': str
+}
+
+
+def read_ledger(path_to_ledger: str = os.path.join('data', 'deposits', rekeningoverzicht_filename)) -> pd.DataFrame:
+    """
+    Read the rekeningoverzicht (Account.csv) once. The parsed ledger is cached on path, size and modification time,
+    so costs, dividends and deposits share a single parse as long as the file does not change.
+
+    :param path_to_ledger: path to the rekeningoverzicht export.
+    :return ledger: all rows of the rekeningoverzicht with a categorical 'Categorie' column.
+    """
+
+    stat = os.stat(path_to_ledger)
+    return _parse_ledger(path_to_ledger, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _parse_ledger(path_to_ledger: str, size: int, mtime_ns: int) -> pd.DataFrame:
+    """
+    Parse and classify the rekeningoverzicht. Size and mtime are only part of the signature to key the cache.
+
+    :param path_to_ledger: path to the rekeningoverzicht export.
+    :param size: file size in bytes.
+    :param mtime_ns: file modification time in nanoseconds.
+    :return ledger: all rows of the rekeningoverzicht with a categorical 'Categorie' column.
+    """
+
+    ledger = pd.read_csv(path_to_ledger, dtype=ledger_dtypes)
+    ledger['Datum'] = pd.to_datetime(ledger['Datum'], format='%d-%m-%Y')
+
+    # classify every row once
+    omschrijving = ledger['Omschrijving']
+    categorie = np.select(
+        [
+            omschrijving.isin(['iDEAL Deposit', 'iDEAL storting', 'flatex terugstorting']),
+            omschrijving == 'Dividend',
+            omschrijving == 'Dividendbelasting',
+            omschrijving.str.contains('kosten').fillna(False).astype(bool)
+        ],
+        ledger_categories[:-1],
+        default='other'
+    )
+    ledger['Categorie'] = pd.Categorical(categorie, categories=ledger_categories)
+
+    return ledger
+
+
+def ledger_rows(*categories: str) -> pd.DataFrame:
+    """
+    Select the rows of the rekeningoverzicht belonging to one or more categories.
+
+    :param categories: categories from ledger_categories to select.
+    :return rows of the ledger in the given categories.
+    """
+
+    ledger = read_ledger()
+    return ledger.loc[ledger['Categorie'].isin(categories)]
 
 
 def read_costs() -> pd.DataFrame:
@@ -13,14 +81,13 @@ def read_costs() -> pd.DataFrame:
 
     :return overview of costs over time.
     """
-    costs = pd.read_csv(os.path.join('data', 'deposits', rekeningoverzicht_filename))
-    costs = costs[costs['Omschrijving'].str.contains('kosten').fillna(False)].copy()
+    costs = ledger_rows('cost').copy()
     costs = costs.rename(columns={'Unnamed: 8': 'Kosten'})
     #costs['Kosten'] = costs['Kosten'].str.replace(',', '.').astype(float)
     # change omschrijving
     costs['Omschrijving'] = costs['Omschrijving'].str.replace('DEGIRO transactiekosten', 'Transactiekosten')
     costs['Omschrijving'] = costs['Omschrijving'].str.replace('.*Aansluitingskosten.*', 'Aansluitingskosten')
-    costs['Jaar'] = pd.DatetimeIndex(pd.to_datetime(costs['Datum'], format='%d-%m-%Y')).year
+    costs['Jaar'] = pd.DatetimeIndex(costs['Datum']).year
     costs = costs[['Jaar', 'Omschrijving', 'Kosten']]
 
     return costs
@@ -32,13 +99,9 @@ def read_dividends() -> pd.DataFrame:
 
     :return overview of dividends over time.
     """
-    dividend = pd.read_csv(os.path.join('data', 'deposits', rekeningoverzicht_filename))
-    dividend = dividend.loc[
-        (dividend['Omschrijving'] == 'Dividend') | (dividend['Omschrijving'] == 'Dividendbelasting')
-        ].copy()
+    dividend = ledger_rows('dividend', 'dividend tax').copy()
     dividend = dividend.rename(columns={'Unnamed: 8': 'Dividend'})
     #dividend['Dividend'] = dividend['Dividend'].str.replace(',', '.').astype(float)
-    dividend['Datum'] = pd.to_datetime(dividend['Datum'], format='%d-%m-%Y')
     dividend['Quarter'] = pd.PeriodIndex(dividend['Datum'], freq='Q')
     dividend = dividend[['Quarter', 'Product', 'Dividend', 'Mutatie']]
 
@@ -52,65 +115,260 @@ def read_deposits() -> pd.DataFrame:
     :return overview of deposits over time.
     """
 
-    deposits = pd.read_csv(os.path.join('data', 'deposits', rekeningoverzicht_filename))
-    deposits = deposits.loc[
-        (deposits['Omschrijving'] == 'iDEAL Deposit') |
-        (deposits['Omschrijving'] == 'iDEAL storting') |
-        (deposits['Omschrijving'] == 'flatex terugstorting')
-    ].copy()
+    deposits = ledger_rows('deposit').copy()
     deposits = deposits.rename(columns={'Unnamed: 8': 'Storting'})
     deposits = deposits[['Datum', 'Storting']]
     #deposits['Storting'] = deposits['Storting'].str.replace(',', '.').astype(float)
-    deposits['Datum'] = pd.to_datetime(deposits['Datum'], format='%d-%m-%Y')
 
     return deposits
 
 
-def read_portefeuille(path_to_portefeuille_dir: str = os.path.join('data', 'exports'), suffix: str = '.csv') \
-        -> pd.DataFrame:
+def parse_export(path_to_export: str) -> pd.DataFrame:
+    """
+    Parse a single DEGIRO portefeuille export.
+
+    :param path_to_export: path to the export csv.
+    :return data_month: holdings of the export with numeric 'Waarde in EUR'.
+    """
+
+    data_month = pd.read_csv(path_to_export)
+    data_month.drop(columns=['Slotkoers', 'Lokale waarde'], axis=1, inplace=True)
+    data_month['Waarde in EUR'] = pd.to_numeric(data_month['Waarde in EUR'].str.replace(',', '.'))
+
+    return data_month
+
+
+def hash_file(path: str) -> str:
+    """
+    Calculate the sha256 content hash of a file.
+
+    :param path: path to the file.
+    :return: hex digest of the file contents.
+    """
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def read_exports(path_to_portefeuille_dir: str, suffix: str, cache_dir: str = os.path.join('data', 'cache'),
+                 n_workers: int = 1, files: list = None) -> list:
     """
-    Create a list of dataframes with portefeuille holdings.
+    Read the exports in path_to_portefeuille_dir. Parsed exports are kept in a Parquet cache in cache_dir, keyed by
+    file name, size, modification time and content hash. Only new or changed exports are parsed, the others are
+    taken from the cache. The content hash is only calculated when size or modification time changed.
+
+    Newly parsed exports are written to a separate part of the cache, and the manifest holds the part of every export.
+    Reading a few exports therefore only reads their parts, and reading all exports merges the parts into one file.
 
     :param path_to_portefeuille_dir: path to data folder.
     :param suffix: suffix in which file names must end.
-    :return portefeuille: overview of portefeuille combined.
+    :param cache_dir: folder to store the cache in.
+    :param n_workers: number of processes to parse exports with, 1 parses them in this process.
+    :param files: file names of the exports to return, all exports by default.
+    :return: list of (filename, parsed export) tuples in date order.
     """
 
-    # obtain all filesnames
-    filenames = list_filenames(path_to_portefeuille_dir, suffix)
+    main_part = 'exports.parquet'
+    manifest_path = os.path.join(cache_dir, 'exports.json')
+
+    # load manifest, start over if the cache or one of its parts is missing
+    manifest = {}
+    if os.path.exists(os.path.join(cache_dir, main_part)) and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        parts = {entry.get('part', main_part) for entry in manifest.values()}
+        if not all(os.path.exists(os.path.join(cache_dir, part)) for part in parts):
+            manifest = {}
 
-    # read and prep files
-    portefeuille = []
+    filenames = list_filenames(path_to_portefeuille_dir, suffix)
+    manifest_new = {}
+    stale = []
     for file in filenames:
-        date = file.replace('.csv', '')
-        data_month = pd.read_csv(os.path.join(path_to_portefeuille_dir, file))
-        data_month.drop(columns=['Slotkoers', 'Lokale waarde'], axis=1, inplace=True)
-        data_month['Waarde in EUR'] = pd.to_numeric(data_month['Waarde in EUR'].str.replace(',', '.'))
-        data_month = data_month.rename(columns={'Aantal': date + ' (aantal)', 'Waarde in EUR': date + ' (waarde)'})
-        portefeuille.append(data_month)
+        path = os.path.join(path_to_portefeuille_dir, file)
+        stat = os.stat(path)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        known = manifest.get(file)
+        if known is not None and known['size'] == entry['size'] and known['mtime_ns'] == entry['mtime_ns']:
+            manifest_new[file] = dict(known)
+            continue
 
-    # get newest name on ISIN code
-    product_isin = pd.concat(portefeuille)
-    product_isin = product_isin[product_isin['Symbool/ISIN'].notnull()][['Product', 'Symbool/ISIN']]
-    product_isin = product_isin.drop_duplicates(subset='Symbool/ISIN', keep='last')
+        entry['sha256'] = hash_file(path)
+        if known is None or known['sha256'] != entry['sha256']:
+            stale.append(file)
+        else:
+            entry['part'] = known.get('part', main_part)
+        manifest_new[file] = entry
+
+    # parse new or changed exports, optionally in a process pool (map keeps the order of the files)
+    paths = [os.path.join(path_to_portefeuille_dir, file) for file in stale]
+    if n_workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            parsed = list(executor.map(parse_export, paths))
+    else:
+        parsed = list(map(parse_export, paths))
+
+    # newly parsed exports go to a new part, the main part is only written when there is none yet
+    os.makedirs(cache_dir, exist_ok=True)
+    if parsed:
+        part = main_part if not manifest else 'exports-' + str(time.time_ns()) + '.parquet'
+        write_parquet(
+            pd.concat([data_month.assign(Bestand=file) for file, data_month in zip(stale, parsed)], ignore_index=True),
+            os.path.join(cache_dir, part)
+        )
+        for file in stale:
+            manifest_new[file]['part'] = part
+
+    # read the parts of the requested exports, rows of an older version of an export are skipped
+    files = filenames if files is None else [file for file in filenames if file in set(files)]
+    parts = sorted({manifest_new[file].get('part', main_part) for file in files})
+    cached = []
+    for part in parts:
+        data = pd.read_parquet(os.path.join(cache_dir, part))
+        in_part = [file for file in files if manifest_new[file].get('part', main_part) == part]
+        cached.append(data[data['Bestand'].isin(in_part)])
+    cached = pd.concat(cached, ignore_index=True) if cached else pd.DataFrame(columns=['Bestand'])
 
-    portefeuille_updated = []
-    for port in portefeuille:
-        merged_df = port.merge(product_isin, on='Symbool/ISIN', how='left', suffixes=('', '_new'))
-        port['Product'] = merged_df['Product_new'].combine_first(merged_df['Product'])
-        portefeuille_updated.append(port)
+    # merge all parts into one when all exports are read anyway
+    in_use = {entry.get('part', main_part) for entry in manifest_new.values()}
+    if len(files) == len(filenames) and in_use - {main_part}:
+        write_parquet(cached, os.path.join(cache_dir, main_part))
+        for entry in manifest_new.values():
+            entry['part'] = main_part
+        in_use = {main_part}
+
+    if manifest_new != manifest:
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest_new, f, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    for part in os.listdir(cache_dir):
+        if part.startswith('exports-') and part.endswith('.parquet') and part not in in_use:
+            os.remove(os.path.join(cache_dir, part))
+
+    exports = []
+    for file, data_month in cached.groupby('Bestand', sort=False):
+        data_month = data_month.drop(columns='Bestand').reset_index(drop=True)
+        data_month['Symbool/ISIN'] = data_month['Symbool/ISIN'].where(data_month['Symbool/ISIN'].notnull(), np.nan)
+        exports.append((file, data_month))
+    exports = dict(exports)
+    empty = cached.drop(columns='Bestand').iloc[:0]
+
+    return [(file, exports.get(file, empty)) for file in files]
+
+
+def write_parquet(data: pd.DataFrame, path: str):
+    """
+    Write a dataframe to a Parquet file at once, so the file is never half written.
+
+    :param data: Dataframe to write.
+    :param path: path of the Parquet file.
+    """
+
+    data.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def read_fingerprints(cache_dir: str = os.path.join('data', 'cache')) -> dict:
+    """
+    Read the content hashes of the exports in the cache of parsed exports.
+
+    :param cache_dir: folder with the cache of parsed exports.
+    :return: dict with the sha256 per export file name.
+    """
+
+    manifest_path = os.path.join(cache_dir, 'exports.json')
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path) as f:
+        return {file: entry['sha256'] for file, entry in json.load(f).items()}
+
+
+def read_holdings(path_to_portefeuille_dir: str = os.path.join('data', 'exports'), suffix: str = '.csv',
+                  cache_dir: str = os.path.join('data', 'cache'), n_workers: int = export_workers) -> Holdings:
+    """
+    Read all exports into a Holdings cube.
+
+    :param path_to_portefeuille_dir: path to data folder.
+    :param suffix: suffix in which file names must end.
+    :param cache_dir: folder with the cache of parsed exports.
+    :param n_workers: number of processes to parse new exports with.
+    :return holdings: Holdings with aantal and waarde per position and date.
+    """
+
+    # read and prep files, only new or changed exports are parsed
+    exports = read_exports(path_to_portefeuille_dir, suffix, cache_dir, n_workers)
+    return combine_exports([(file.replace('.csv', ''), data_month) for file, data_month in exports])
+
+
+def read_portefeuille(path_to_portefeuille_dir: str = os.path.join('data', 'exports'), suffix: str = '.csv',
+                      cache_dir: str = os.path.join('data', 'cache'), n_workers: int = export_workers) -> pd.DataFrame:
+    """
+    Create a wide overview of the portefeuille holdings with an aantal and waarde column per export.
+
+    :param path_to_portefeuille_dir: path to data folder.
+    :param suffix: suffix in which file names must end.
+    :param cache_dir: folder with the cache of parsed exports.
+    :param n_workers: number of processes to parse new exports with.
+    :return portefeuille: overview of portefeuille combined.
+    """
+
+    holdings = read_holdings(path_to_portefeuille_dir, suffix, cache_dir, n_workers)
+    return holdings.to_frame(['aantal', 'waarde'])
+
+
+def combine_exports(exports: list, previous: Holdings = None) -> Holdings:
+    """
+    Combine parsed exports into a Holdings cube. All exports are stacked into one long table of holdings per date,
+    which is pivoted at once to a (positions x dates) array per metric. Positions are ordered on first appearance, as
+    an outer merge of the exports in date order would. When previous holdings are given, the exports are appended as
+    new dates to them.
+
+    :param exports: list of (date, parsed export) tuples, newer than the dates in previous.
+    :param previous: Holdings to extend, optional.
+    :return holdings: Holdings with aantal and waarde per position and date, procent is zero for the new dates.
+    """
+
+    holdings = pd.concat(
+        [data_month.assign(Datum=date) for date, data_month in exports], ignore_index=True, sort=False
+    )
+    if previous is None:
+        previous = Holdings([], [], pd.DatetimeIndex([]), np.zeros((0, 0, len(metrics))))
+
+    # integer positions of every holding on the position axis: ISIN, or product name for cash positions
+    key = holdings['Symbool/ISIN'].fillna('\x00' + holdings['Product'])
+    keys = pd.Index(previous.keys())
+    first_appearance = ~key.duplicated() & ~key.isin(keys)
+    keys = keys.append(pd.Index(key[first_appearance]))
+    positions = keys.get_indexer(key)
+
+    # integer positions on the date axis
+    dates = [date for date, _ in exports]
+    date_positions = len(previous.dates) + pd.Index(dates).get_indexer(holdings['Datum'])
+
+    # pivot aantal and waarde in one go, missing values are zero. A position listed twice in an export (e.g. one fund
+    # on two exchanges) is added up
+    cube = np.zeros((len(keys), len(previous.dates) + len(dates), len(metrics)))
+    cube[:len(previous.keys()), :len(previous.dates)] = previous.cube
+    np.add.at(cube, (positions, date_positions, 0), holdings['Aantal'].fillna(0).to_numpy(dtype=float))
+    np.add.at(cube, (positions, date_positions, 1), holdings['Waarde in EUR'].fillna(0).to_numpy(dtype=float))
+
+    # get newest name on ISIN code
+    products = np.append(previous.products, holdings.loc[first_appearance, 'Product'].to_numpy())
+    isins = np.append(previous.isins, holdings.loc[first_appearance, 'Symbool/ISIN'].to_numpy())
+    product_isin = holdings[holdings['Symbool/ISIN'].notnull()].drop_duplicates(subset='Symbool/ISIN', keep='last')
+    products[keys.get_indexer(product_isin['Symbool/ISIN'])] = product_isin['Product'].to_numpy()
 
-    # merge all files and set nan to zero
-    portefeuille = reduce(lambda x, y: pd.merge(x, y, on=['Product', 'Symbool/ISIN'], how='outer'), portefeuille_updated)
-    portefeuille = portefeuille.replace('CASH & CASH FUND & FTX CASH(EUR)', 'VRIJE RUIMTE')
-    portefeuille.set_index(['Product', 'Symbool/ISIN'], inplace=True)
-    portefeuille = portefeuille.fillna(0)
-    return portefeuille
+    return Holdings(products, isins, previous.dates.append(pd.to_datetime(dates, format='%Y-%m-%d')), cube)
 
 
 def list_filenames(path_to_portefeuille_dir: str, suffix: str) -> list:
     """
-    List all file names in path_to_data_dir with a certain suffix.
+    List all file names in path_to_data_dir with a certain suffix, sorted so that exports named <%Y-%m-%d>.csv are in
+    date order.
 
     :param path_to_portefeuille_dir: path to data folder.
     :param suffix: suffix in which file names must end.
@@ -118,4 +376,4 @@ def list_filenames(path_to_portefeuille_dir: str, suffix: str) -> list:
     """
 
     filenames = listdir(path_to_portefeuille_dir)
-    return [filename for filename in filenames if filename.endswith(suffix)]
+    return sorted(filename for filename in filenames if filename.endswith(suffix))
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.holdings import Holdings
+
+state_version = 1
+
+
+def hash_deposits(deposits: pd.DataFrame) -> str:
+    """
+    Calculate a content hash of deposits, to detect changes in the rekeningoverzicht.
+
+    :param deposits: Dataframe with deposits data.
+    :return: hex digest of the deposits.
+    """
+
+    hashes = pd.util.hash_pandas_object(deposits[['Datum', 'Storting']], index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+
+def save_state(path: str, holdings: Holdings, totals: pd.DataFrame, winstverlies: pd.Series, deposits: pd.DataFrame,
+               exports: dict, deposits_hash: str):
+    """
+    Save the computed portefeuille, so a next run only has to compute the dates of new exports.
+
+    :param path: path of the state file.
+    :param holdings: Holdings with percentages.
+    :param totals: Dataframe with the respective totals.
+    :param winstverlies: Series with the respective winstverlies.
+    :param deposits: Dataframe with deposits matched to the export dates.
+    :param exports: dict with the sha256 of every export in holdings.
+    :param deposits_hash: hash of the deposits up to the newest export.
+    """
+
+    meta = {'version': state_version, 'exports': exports, 'deposits_hash': deposits_hash}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            meta=np.array(json.dumps(meta)),
+            products=holdings.products.astype(str),
+            isins=pd.Series(holdings.isins, dtype=object).fillna('').to_numpy().astype(str),
+            dates=holdings.dates.values,
+            cube=holdings.cube,
+            totals=totals.to_numpy(),
+            winstverlies=winstverlies.to_numpy(),
+            deposits_datum=deposits['Datum'].values,
+            deposits_storting=deposits['Storting'].to_numpy(dtype=float)
+        )
+    os.replace(path + '.tmp', path)
+
+
+def load_state(path: str):
+    """
+    Load the state of a previous run.
+
+    :param path: path of the state file.
+    :return: dict with holdings, totals, winstverlies, deposits, exports and deposits_hash, or None if there is no
+        usable state.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as state:
+        meta = json.loads(str(state['meta']))
+        if meta['version'] != state_version:
+            return None
+
+        isins = state['isins'].astype(object)
+        isins[isins == ''] = np.nan
+        holdings = Holdings(state['products'].astype(object), isins, pd.DatetimeIndex(state['dates']), state['cube'])
+        deposits = pd.DataFrame({'Datum': state['deposits_datum'], 'Storting': state['deposits_storting']})
+
+        return {
+            'holdings': holdings,
+            'totals': state['totals'],
+            'winstverlies': state['winstverlies'],
+            'deposits': deposits,
+            'exports': meta['exports'],
+            'deposits_hash': meta['deposits_hash']
+        }
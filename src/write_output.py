@@ -1,26 +1,105 @@
 import calendar
+import hashlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
+import settings
+from src.benchmarks import BenchmarkSimulation
 from src.read_data import read_dividends, read_costs
-from settings import header_r, header_l, port_header, port_header_border, aantal_pos, aantal_neg, aantal_neutral, \
-    waarde, procent_pos, procent_neg, procent_neutral, totaal_font, totaal_num, winstverlies_font, winstverlies_num, \
-    jaaroverzicht_font, jaaroverzicht_num, header_color, positive_color, months_translation, rekeningoverzicht_filename
+from settings import header_color, positive_color, months_translation, rekeningoverzicht_filename, plot_workers, \
+    plot_cache_max_age
 
+dividend_colors = ['#1D2F6F', '#FAC748', '#6EAF46', '#8390FA']
+# version of the plot functions in the plot cache, increase it when the plots change
+plot_cache_version = 1
+# styles in settings.py that are added to the workbook as cell formats
+cell_styles = [
+    'header_r', 'header_l', 'frame_header', 'port_header', 'port_header_border', 'aantal_pos', 'aantal_neg',
+    'aantal_neutral', 'waarde', 'procent_pos', 'procent_neg', 'procent_neutral', 'totaal_font', 'totaal_num',
+    'winstverlies_font', 'winstverlies_num', 'jaaroverzicht_font', 'jaaroverzicht_num'
+]
 
-def format_header(wb, ws, year: int):
+
+def add_formats(wb) -> dict:
     """
-    Format sheet header.
+    Add the cell styles of settings.py to the workbook, once per workbook so all sheets share the same formats.
 
     :param wb: xlsxwriter Workbook object.
+    :return: Dict with the xlsxwriter Format object per style name.
+    """
+
+    return {style: wb.add_format(getattr(settings, style)) for style in cell_styles}
+
+
+def write_frame(
+        writer: pd.ExcelWriter, formats: dict, df: pd.DataFrame, sheet_name: str, startrow: int = 0, index: bool = True
+):
+    """
+    Write dataframe to sheet like DataFrame.to_excel, but with the cells in row order. DataFrame.to_excel writes the
+    body column by column, which drops cells when the workbook is written with the constant_memory option.
+
+    :param writer: ExcelWriter object to write the sheet to.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
+    :param df: Dataframe to write.
+    :param sheet_name: name of the sheet, it is created if it does not exist yet.
+    :param startrow: Integer to start writing at.
+    :param index: write the index of the dataframe.
+    """
+
+    wb = writer.book
+    ws = wb.get_worksheet_by_name(sheet_name)
+    if ws is None:
+        ws = wb.add_worksheet(sheet_name)
+    format_frame_header = formats['frame_header']
+
+    row = startrow
+    if isinstance(df.columns, pd.MultiIndex):
+        # a header row per level with the level name in front, equal neighbouring labels are merged
+        for level, name in enumerate(df.columns.names):
+            ws.write(row, 0, name, format_frame_header)
+            col = 1
+            for key, columns in itertools.groupby(df.columns, key=lambda column: column[:level + 1]):
+                span = len(list(columns))
+                if span > 1:
+                    ws.merge_range(row, col, row, col + span - 1, key[level], format_frame_header)
+                else:
+                    ws.write(row, col, key[level], format_frame_header)
+                col += span
+            row += 1
+        if df.index.name:
+            ws.write(row, 0, df.index.name, format_frame_header)
+        row += 1
+    else:
+        if index and df.index.name:
+            ws.write(row, 0, df.index.name, format_frame_header)
+        ws.write_row(row, int(index), df.columns, format_frame_header)
+        row += 1
+
+    # empty cells are left out
+    for label, values in zip(df.index, df.itertuples(index=False)):
+        if index:
+            ws.write(row, 0, label, format_frame_header)
+        ws.write_row(row, int(index), [None if pd.isna(value) else value for value in values])
+        row += 1
+
+
+def format_header(ws, formats: dict, year: int):
+    """
+    Format sheet header.
+
     :param ws: xlsxwriter Worksheet object.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :param year: Dataframe with totals overview.
     """
 
-    format_header_r = wb.add_format(header_r)
-    format_header_l = wb.add_format(header_l)
+    format_header_r = formats['header_r']
+    format_header_l = formats['header_l']
     ws.write(0, 0, year, format_header_r)
     ws.write(0, 1, "Waarde Portefeuille", format_header_l)
 
@@ -38,12 +117,12 @@ def set_cell_widths(ws, colnum: int):
     ws.set_row(0, 32)
 
 
-def format_portefeuille(wb, ws, df: pd.DataFrame, start_row: int, port_prev: pd.DataFrame = None):
+def format_portefeuille(ws, formats: dict, df: pd.DataFrame, start_row: int, port_prev: pd.DataFrame = None):
     """
     Format portefeuille overview and write to sheet.
 
-    :param wb: xlsxwriter Workbook object.
     :param ws: xlsxwriter Worksheet object.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :param df: Dataframe with portefeuille overview.
     :param start_row: Integer to start writing at.
     :param port_prev: Dataframe with portefeuille data from previous year.
@@ -62,8 +141,8 @@ def format_portefeuille(wb, ws, df: pd.DataFrame, start_row: int, port_prev: pd.
         port_prev = port_prev[port_prev.columns[-1][:10] + ' (aantal)']
 
     # portefeuille header
-    format_port_header = wb.add_format(port_header)
-    format_port_header_border = wb.add_format(port_header_border)
+    format_port_header = formats['port_header']
+    format_port_header_border = formats['port_header_border']
     for col_num, value in enumerate(df.columns.values):
         if 'waarde' in value:
             value = value.replace(' (waarde)', '')
@@ -77,76 +156,68 @@ def format_portefeuille(wb, ws, df: pd.DataFrame, start_row: int, port_prev: pd.
             ws.write(start_row, col_num, value, format_port_header)
 
     # add numbers
-    format_aantal_pos = wb.add_format(aantal_pos)
-    format_aantal_neg = wb.add_format(aantal_neg)
-    format_aantal_neutral = wb.add_format(aantal_neutral)
-    format_waarde = wb.add_format(waarde)
-    format_procent_pos = wb.add_format(procent_pos)
-    format_procent_neg = wb.add_format(procent_neg)
-    format_procent_neutral = wb.add_format(procent_neutral)
+    format_aantal_pos = formats['aantal_pos']
+    format_aantal_neg = formats['aantal_neg']
+    format_aantal_neutral = formats['aantal_neutral']
+    format_waarde = formats['waarde']
+    format_procent_pos = formats['procent_pos']
+    format_procent_neg = formats['procent_neg']
+    format_procent_neutral = formats['procent_neutral']
 
     # count number of rows with cash positions (need different style below)
     rows_cash_position = df['Product'].str.contains('CASH').sum() - 1
-
-    for i in range(len(df.index)):
-        for j in range(len(df.columns)):
-            # writing aantallen
-            if 'aantal' in df.columns[j]:
-                if j > 2:
-                    # we can determine the aantal coloring based on previous entry
-                    if df.iloc[i, j] > df.iloc[i, j - 3] and i > rows_cash_position:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_aantal_pos)
-                    elif df.iloc[i, j] < df.iloc[i, j - 3] and i > rows_cash_position:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_aantal_neg)
-                    elif i > rows_cash_position:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_aantal_neutral)
-                    else:
-                        ws.write(start_row + i + 1, j, '', format_aantal_neutral)
-                elif i > rows_cash_position and port_prev is None:
-                    # first entry of the year and there is not previous data
-                    ws.write(start_row + i + 1, j, df.iloc[i, j], format_aantal_neutral)
-                elif i > rows_cash_position:
-                    # first entry of the year but we have a previous year
-                    if df.iloc[i, j] > port_prev[i] and i > rows_cash_position:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_aantal_pos)
-                    elif df.iloc[i, j] < port_prev[i] and i > rows_cash_position:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_aantal_neg)
-                    elif i > rows_cash_position:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_aantal_neutral)
-                    else:
-                        ws.write(start_row + i + 1, j, '', format_aantal_neutral)
-
-            elif 'waarde' in df.columns[j]:
-                ws.write(start_row + i + 1, j, df.iloc[i, j], format_waarde)
-            elif 'procent' in df.columns[j]:
-                if i > rows_cash_position:
-                    if df.iloc[i, j] > 0:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_procent_pos)
-                    elif df.iloc[i, j] < 0:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_procent_neg)
-                    else:
-                        ws.write(start_row + i + 1, j, df.iloc[i, j], format_procent_neutral)
-            else:
-                # product names
-                ws.write(start_row + i + 1, j, df.iloc[i, j])
-
-
-def format_totals(wb, ws, totals: pd.DataFrame, start_row: int):
+    is_cash = np.arange(len(df.index)) <= rows_cash_position
+
+    # columns are (aantal, waarde, procent) per date
+    values = df.drop('Product', axis=1).to_numpy(dtype=float)
+    aantal = values[:, 0::3]
+    procent = values[:, 2::3]
+
+    # aantal coloring is based on the previous entry, for the first entry of the year on the previous year (if any)
+    aantal_prev = np.empty_like(aantal)
+    aantal_prev[:, 1:] = aantal[:, :-1]
+    aantal_prev[:, 0] = aantal[:, 0] if port_prev is None else port_prev.to_numpy(dtype=float)
+
+    # determine value and format of every cell once
+    cells = values.astype(object)
+    formats = np.empty(values.shape, dtype=object)
+    formats[:, 0::3] = np.select(
+        [aantal > aantal_prev, aantal < aantal_prev], [format_aantal_pos, format_aantal_neg], format_aantal_neutral
+    )
+    formats[:, 1::3] = format_waarde
+    formats[:, 2::3] = np.select(
+        [procent > 0, procent < 0], [format_procent_pos, format_procent_neg], format_procent_neutral
+    )
+
+    # cash positions only show waarde, with an empty aantal cell after the first entry
+    written = np.ones(values.shape, dtype=bool)
+    written[is_cash, 0] = False
+    written[is_cash, 2::3] = False
+    formats[is_cash, 0::3] = format_aantal_neutral
+    cells[np.ix_(is_cash, np.arange(3, values.shape[1], 3))] = ''
+
+    for i, product in enumerate(df['Product']):
+        ws.write(start_row + i + 1, 0, product)  # product names
+        for j in np.flatnonzero(written[i]):
+            ws.write(start_row + i + 1, j + 1, cells[i, j], formats[i, j])
+
+
+def format_totals(ws, formats: dict, totals: pd.DataFrame, start_row: int):
     """
     Format overview totals and write to sheet.
 
-    :param wb: xlsxwriter Workbook object.
     :param ws: xlsxwriter Worksheet object.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :param totals: Dataframe with totals overview.
     :param start_row: Integer to start writing at.
     """
 
-    format_totaal_font = wb.add_format(totaal_font)
-    format_totaal_num = wb.add_format(totaal_num)
+    format_totaal_font = formats['totaal_font']
+    format_totaal_num = formats['totaal_num']
     totals = totals.reset_index()
-    format_procent_pos = wb.add_format(procent_pos)
-    format_procent_neg = wb.add_format(procent_neg)
-    format_procent_neutral = wb.add_format(procent_neutral)
+    format_procent_pos = formats['procent_pos']
+    format_procent_neg = formats['procent_neg']
+    format_procent_neutral = formats['procent_neutral']
 
     for i in range(len(totals.index)):
         for j in range(len(totals.columns)):
@@ -171,21 +242,21 @@ def format_totals(wb, ws, totals: pd.DataFrame, start_row: int):
                     ws.write(start_row + i + 1, j, totals.iloc[i, j])
 
 
-def format_winstverlies(wb, ws, winstverlies: pd.DataFrame, start_row: int):
+def format_winstverlies(ws, formats: dict, winstverlies: pd.DataFrame, start_row: int):
     """
     Format wint verlies row and write to sheet.
 
-    :param wb: xlsxwriter Workbook object.
     :param ws: xlsxwriter Worksheet object.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :param winstverlies: Series with winstverlies overview.
     :param start_row: Integer to start writing at.
     """
 
-    format_procent_pos = wb.add_format(procent_pos)
-    format_procent_neg = wb.add_format(procent_neg)
-    format_procent_neutral = wb.add_format(procent_neutral)
-    format_winstverlies_font = wb.add_format(winstverlies_font)
-    format_winstverlies_num = wb.add_format(winstverlies_num)
+    format_procent_pos = formats['procent_pos']
+    format_procent_neg = formats['procent_neg']
+    format_procent_neutral = formats['procent_neutral']
+    format_winstverlies_font = formats['winstverlies_font']
+    format_winstverlies_num = formats['winstverlies_num']
 
     ws.write(start_row + 1, 0, "Winst/Verlies", format_winstverlies_font)
     for i in range(len(winstverlies.index)):
@@ -206,28 +277,30 @@ def format_winstverlies(wb, ws, winstverlies: pd.DataFrame, start_row: int):
 
 
 def format_jaaroverzicht(
-        wb, ws, totals: pd.DataFrame, start_row: int, year: str, total_invested: float, total_waarde_full: list,
-        deposits: pd.DataFrame, benchmark: pd.DataFrame
+        wb, ws, formats: dict, totals: pd.DataFrame, start_row: int, year: str, total_invested: float,
+        total_waarde_full: list, simulation: BenchmarkSimulation, native_charts: bool = False, plots: list = None
 ):
     """
     Format jaaroverzicht and write to sheet.
 
     :param wb: xlsxwriter Workbook object.
     :param ws: xlsxwriter Worksheet object.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :param totals: Dataframe with totals overview.
     :param start_row: Integer to start writing at.
     :param year: String with current year of writing.
     :param total_invested: Float number of total investments.
     :param total_waarde_full: List with total waarde to pass to overview.
-    :param deposits: Dataframe with deposits made.
-    :param benchmark: Dataframe with benchmark pricing data.
+    :param simulation: BenchmarkSimulation with the deposits invested in the benchmarks.
+    :param native_charts: add a native Excel chart instead of a matplotlib image.
+    :param plots: list to collect the matplotlib image in, to render it later with insert_plots.
 
     :return total_invested: Float updated number of total investments.
     """
 
-    format_winstverlies_font = wb.add_format(winstverlies_font)
-    format_jaaroverzicht_font = wb.add_format(jaaroverzicht_font)
-    format_jaaroverzicht_num = wb.add_format(jaaroverzicht_num)
+    format_winstverlies_font = formats['winstverlies_font']
+    format_jaaroverzicht_font = formats['jaaroverzicht_font']
+    format_jaaroverzicht_num = formats['jaaroverzicht_num']
 
     totals_waarde = totals.loc[:, totals.columns.str.contains('waarde')]
     totals_waarde = totals_waarde.append(pd.Series(
@@ -239,82 +312,70 @@ def format_jaaroverzicht(
     total_invested = totals_waarde['Inleg'].iloc[-1]
     totals_waarde = totals_waarde.rename(columns={'Totaal portefeuille': 'Portefeuille'})
 
-    for i in range(len(totals.columns) + 1):
-        if 0 < i < len(totals_waarde.columns):
-            ws.write(start_row, i, totals_waarde.columns[i], format_jaaroverzicht_font)
-        elif i >= len(totals_waarde.columns):
+    # a native chart references its data on the sheet, so the benchmark values are written next to the table
+    table = simulation.simulate(totals_waarde) if native_charts else totals_waarde
+
+    for i in range(max(len(totals.columns) + 1, len(table.columns))):
+        if 0 < i < len(table.columns):
+            ws.write(start_row, i, table.columns[i], format_jaaroverzicht_font)
+        elif i >= len(table.columns):
             ws.write(start_row, i, '', format_jaaroverzicht_font)
         else:
             ws.write(start_row, 0, 'Jaaroverzicht', format_winstverlies_font)
 
-    for i in range(len(totals_waarde.index)):
-        for j in range(len(totals_waarde.columns)):
+    for i in range(len(table.index)):
+        for j in range(len(table.columns)):
             if j > 0:
-                ws.write(start_row + i + 1, j, totals_waarde.iloc[i, j], format_jaaroverzicht_num)
+                ws.write(start_row + i + 1, j, table.iloc[i, j], format_jaaroverzicht_num)
             else:
-                ws.write(start_row + i + 1, j, totals_waarde.iloc[i, j])
+                ws.write(start_row + i + 1, j, table.iloc[i, j])
 
-    add_jaaroverzicht_plot(ws, totals_waarde, deposits, benchmark, start_row, year)
+    if native_charts:
+        add_jaaroverzicht_chart(wb, ws, table, start_row, year)
+    else:
+        add_jaaroverzicht_plot(ws, totals_waarde, simulation, start_row, year, plots)
 
     total_waarde_full.append(totals_waarde)  # pass to overview over the years
 
     return total_invested, total_waarde_full
 
 
-def simulate_benchmark_values(totals_waarde: pd.DataFrame, deposits: pd.DataFrame, benchmark: pd.DataFrame):
+def add_jaaroverzicht_plot(
+        ws, totals_waarde: pd.DataFrame, simulation: BenchmarkSimulation, start_row: int, year: str, plots: list = None
+):
     """
-    Simulate value of benchmark file with the deposits and starting value that was made.
-
-    :param totals_waarde: List with total waarde to pass to overview.
-    :param deposits: Dataframe with deposits made.
-    :param benchmark: Dataframe with benchmark pricing data.
+    Capture jaaroverzicht in image and write to Excel.
 
-    :return totals_waarde: Dataframe with total waarde.
+    :param ws: xlsxwriter Worksheet object.
+    :param totals_waarde: Dataframe with totals info.
+    :param simulation: BenchmarkSimulation with the deposits invested in the benchmarks.
+    :param start_row: Integer to start writing at.
+    :param year: String with current year of writing.
+    :param plots: list to collect the plot in, to render it later with insert_plots. Rendered right away if None.
     """
 
-    deposits_period = deposits[
-        (deposits['Datum'] > min(totals_waarde['index'])) &
-        (deposits['Datum'] <= max(totals_waarde['index']))
-    ]
-    deposits_period = pd.concat([
-        deposits_period,
-        pd.DataFrame({
-                'Datum': [pd.to_datetime(totals_waarde['index'].iloc[0])],
-                'Storting': [totals_waarde['Portefeuille'].iloc[0]]
-        })
-    ]).reset_index(drop=True)
-    deposits_period = deposits_period.merge(benchmark, left_on='Datum', right_on='date').drop('date', axis=1)
-    deposits_period = deposits_period.sort_values('Datum').reset_index(drop=True)
-
-    for col in deposits_period:
-        if 'price_' in col:
-            name = col.replace('price_', '')
-            deposits_period[f"{name}"] = (deposits_period["Storting"] / deposits_period[col]).cumsum() * deposits_period[col]
-            deposits_period = deposits_period.drop(col, axis=1)
+    totals_waarde = simulation.simulate(totals_waarde)
+    plot = (
+        ws, start_row + 2, 5 if year != '' else 1, 'portefeuille_ontwikkeling_' + year + '.png', plot_jaaroverzicht,
+        (totals_waarde, year)
+    )
 
-    deposits_period['Datum'] = deposits_period['Datum'].astype(str)
-    totals_waarde = totals_waarde.merge(deposits_period, left_on='index', right_on='Datum', how='left')
-    totals_waarde = totals_waarde.drop(['Storting', 'Datum'], axis=1)
-    totals_waarde = totals_waarde.ffill().bfill()
+    if plots is None:
+        insert_plots([plot])
+    else:
+        plots.append(plot)
 
-    return totals_waarde
 
-
-def add_jaaroverzicht_plot(
-        ws, totals_waarde: pd.DataFrame, deposits: pd.DataFrame, benchmark: pd.DataFrame, start_row: int, year: str
-):
+def plot_jaaroverzicht(totals_waarde: pd.DataFrame, year: str) -> bytes:
     """
-    Capture jaaroverzicht in image and write to Excel.
-
-    :param ws: xlsxwriter Worksheet object.
-    :param totals_waarde: Dataframe with totals info.
+    Render jaaroverzicht with the simulated benchmark values as png.
 
-    :param benchmark: Dataframe with benchmark pricing data.
-    :param start_row: Integer to start writing at.
+    :param totals_waarde: Dataframe with totals info and benchmark values.
     :param year: String with current year of writing.
+    :return: png image.
     """
 
-    totals_waarde = simulate_benchmark_values(totals_waarde, deposits, benchmark)
+    import matplotlib.pyplot as plt
 
     plt.plot(totals_waarde['Portefeuille'], color=header_color, label='Portefeuille')
     plt.plot(totals_waarde['Inleg'], 'k', label='Inleg')
@@ -343,14 +404,160 @@ def add_jaaroverzicht_plot(
         figure = plt.gcf()  # get current figure
         figure.set_size_inches(len(totals_waarde)/3, 6)
 
-    plt.savefig('portefeuille_ontwikkeling_' + year + '.png', bbox_inches='tight', dpi=100)
-    ws.insert_image(start_row + 2, 5 if year != '' else 1, 'portefeuille_ontwikkeling_' + year + '.png')
+    image = BytesIO()
+    plt.savefig(image, format='png', bbox_inches='tight', dpi=100)
     plt.close()
 
+    return image.getvalue()
+
+
+def hash_plot(function, args: tuple) -> str:
+    """
+    Calculate a content hash of a plot, i.e. of the plot function, its version, the matplotlib version and the data it
+    is rendered from.
+
+    :param function: function rendering the plot.
+    :param args: arguments of the function.
+    :return: hex digest of the plot.
+    """
+
+    import matplotlib
+
+    h = hashlib.sha256(function.__name__.encode())
+    h.update((str(plot_cache_version) + ' ' + matplotlib.__version__).encode())
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            h.update(repr(list(arg.columns)).encode())
+            h.update(pd.util.hash_pandas_object(arg).to_numpy().tobytes())
+        else:
+            h.update(repr(arg).encode())
+
+    return h.hexdigest()
+
+
+def render_plot(function, args: tuple, path: str) -> bytes:
+    """
+    Render a plot, or take it from the cache when it was rendered from the same data before.
+
+    :param function: function rendering the plot as png.
+    :param args: arguments of the function.
+    :param path: path of the plot in the cache.
+    :return: png image.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            image = f.read()
+        os.utime(path)  # mark as used, for prune_plot_cache
+        return image
+    except FileNotFoundError:
+        pass
+
+    image = function(*args)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.' + str(os.getpid()) + '.tmp', 'wb') as f:
+        f.write(image)
+    os.replace(path + '.' + str(os.getpid()) + '.tmp', path)
+
+    return image
+
+
+def insert_plots(plots: list, n_workers: int = plot_workers, cache_dir: str = os.path.join('data', 'cache', 'plots')):
+    """
+    Render plots and insert them in their sheets. Plots are rendered in memory, optionally in a process pool, and
+    cached in cache_dir on the data they are rendered from.
+
+    :param plots: list of (ws, row, col, image name, plot function, arguments) tuples.
+    :param n_workers: number of processes to render plots with, 1 renders them one after another.
+    :param cache_dir: folder to store rendered plots in.
+    """
+
+    functions = [plot[4] for plot in plots]
+    args = [plot[5] for plot in plots]
+    paths = [os.path.join(cache_dir, hash_plot(function, arg) + '.png') for function, arg in zip(functions, args)]
+    if n_workers > 1 and len(plots) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            images = list(executor.map(render_plot, functions, args, paths))
+    else:
+        images = list(map(render_plot, functions, args, paths))
+
+    for (ws, row, col, name, _, _), image in zip(plots, images):
+        ws.insert_image(row, col, name, {'image_data': BytesIO(image)})
+
+
+def prune_plot_cache(cache_dir: str = os.path.join('data', 'cache', 'plots'), max_age: float = plot_cache_max_age):
+    """
+    Remove the plots from the cache that were not used for max_age days, e.g. of the current year before the last
+    export. The age is taken from the modification time, which is renewed every time a plot is used. Plots of other
+    runs sharing the cache are therefore kept.
+
+    :param cache_dir: folder the rendered plots are stored in.
+    :param max_age: days to keep a plot after it was last used.
+    """
+
+    if not os.path.isdir(cache_dir):
+        return
+
+    oldest = time.time() - max_age * 24 * 3600
+    for file in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file)
+        try:
+            if file.endswith('.png') and os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except FileNotFoundError:
+            pass  # removed by another run
+
+
+def add_jaaroverzicht_chart(wb, ws, table: pd.DataFrame, start_row: int, year: str):
+    """
+    Add native Excel chart of the jaaroverzicht. The chart references the table on the sheet, i.e. a header row at
+    start_row followed by a row per date with Portefeuille, Inleg, Winst/Verlies and the benchmark values.
+
+    :param wb: xlsxwriter Workbook object.
+    :param ws: xlsxwriter Worksheet object.
+    :param table: Dataframe with the jaaroverzicht as written to the sheet, dates in the first column.
+    :param start_row: Integer row of the table header.
+    :param year: String with current year of writing, empty for the overview over all years.
+    """
+
+    sheet_name = ws.get_name()
+    columns = list(table.columns)
+    first_row, last_row = start_row + 1, start_row + len(table.index)
+
+    def series(name: str) -> dict:
+        col = columns.index(name)
+        return {
+            'name': [sheet_name, start_row, col],
+            'categories': [sheet_name, first_row, 0, last_row, 0],
+            'values': [sheet_name, first_row, col, last_row, col]
+        }
+
+    chart = wb.add_chart({'type': 'column'})
+    chart.add_series({
+        **series('Winst/Verlies'),
+        'fill': {'color': positive_color},
+        'data_labels': {'value': True, 'num_format': '#,##0;(#,##0)'}
+    })
+
+    lines = wb.add_chart({'type': 'line'})
+    line_colors = {
+        'Portefeuille': header_color, 'Inleg': '#000000', 'SP500': '#0000FF', 'MSCI_World': '#00BFBF', 'AEX': '#BF00BF'
+    }
+    for name, color in line_colors.items():
+        if name in columns:
+            lines.add_series({**series(name), 'line': {'color': color}})
+    chart.combine(lines)
+
+    chart.set_title({'name': 'Portefeuille ontwikkeling ' + year})
+    chart.set_x_axis({'num_font': {'rotation': -45}})
+    chart.set_y_axis({'major_gridlines': {'visible': True}})
+    chart.set_size({'width': max(640, len(table.index) * 100 // 3), 'height': 480 if year != '' else 600})
+    ws.insert_chart(start_row + 2, len(columns) + 1, chart)
+
 
 def write_portefeuille(
-        portefeuille_dict: dict, totals_dict: dict, winstverlies_dict: dict, deposits: pd.DataFrame,
-        benchmark: pd.DataFrame, wb, writer
+        portefeuille_dict: dict, totals_dict: dict, winstverlies_dict: dict, simulation: BenchmarkSimulation, wb,
+        formats: dict, writer, native_charts: bool = False
 ):
     """
     Write portefeuille info to Excel.
@@ -358,16 +565,18 @@ def write_portefeuille(
     :param portefeuille_dict: Dict with portefeuille info.
     :param totals_dict: Dict with totals info.
     :param winstverlies_dict: Dict with winstverlies.
-    :param deposits: Dataframe with deposits made.
-    :param benchmark: Dataframe with benchmark pricing data.
+    :param simulation: BenchmarkSimulation with the deposits invested in the benchmarks.
     :param wb: xlsxwriter Workbook object.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :param writer: xlsxwriter Writer object.
+    :param native_charts: add native Excel charts instead of matplotlib images.
     :return writer: xlsxwriter Writer object.
     """
 
     port_prev = None
     total_invested = 0
     totals_waarde_full = []
+    plots = []  # the plots of all years are rendered together after writing the sheets
     for key in portefeuille_dict:
         portefeuille = portefeuille_dict[key]
         totals = totals_dict[key]
@@ -376,45 +585,51 @@ def write_portefeuille(
         ws = wb.get_worksheet_by_name(key)
         writer.sheets[key] = ws
 
+        # sheets are written top-down (header first), so they can be streamed with constant_memory
+        format_header(ws, formats, key)
+        set_cell_widths(ws, len(portefeuille.columns))
+        ws.freeze_panes(2, 1)
         start_row = 1
 
         # format sheet
         # get the length of the portefeuille that will be written to the sheet
         len_port = sum((portefeuille.drop(['Product', 'Symbool/ISIN'], axis=1) != 0).any(axis=1))
-        format_portefeuille(wb, ws, portefeuille, start_row, port_prev)
+        format_portefeuille(ws, formats, portefeuille, start_row, port_prev)
         start_row += len_port + 2
 
         # write totals, winstverlies
-        format_totals(wb, ws, totals, start_row)
+        format_totals(ws, formats, totals, start_row)
         start_row += len(totals.index) + 1
-        format_winstverlies(wb, ws, winstverlies, start_row)
+        format_winstverlies(ws, formats, winstverlies, start_row)
         start_row += 4
 
         # format jaaroverzicht. keep the total invest amount to take to the next year total inleg
         total_invested, totals_waarde_full = format_jaaroverzicht(
-            wb, ws, totals, start_row, key, total_invested, totals_waarde_full, deposits, benchmark
+            wb, ws, formats, totals, start_row, key, total_invested, totals_waarde_full, simulation, native_charts, plots
         )
-        format_header(wb, ws, key)
-        set_cell_widths(ws, len(portefeuille.columns))
-        ws.freeze_panes(2, 1)
 
         port_prev = portefeuille
 
+    insert_plots(plots)
+
     return writer, totals_waarde_full
 
 
-def plot_total_dividend(totals: pd.DataFrame):
+def plot_total_dividend(totals: pd.DataFrame) -> bytes:
     """
     Create a stacked barplot with quarterly dividends.
 
     :param totals: dataframe with dividends.
+    :return: png image.
     """
 
+    import matplotlib.pyplot as plt
+
     x = np.arange(0, len(totals))
     fig, ax = plt.subplots()
 
     incr = list(np.linspace(start=-0.2, stop=0.2, num=len(totals.columns)))
-    color = ['#1D2F6F', '#FAC748', '#6EAF46', '#8390FA']
+    color = dividend_colors
     i = 0
 
     if len(totals.columns):
@@ -435,16 +650,52 @@ def plot_total_dividend(totals: pd.DataFrame):
 
     plt.title('Dividend overview')
     plt.legend(totals.columns, loc='upper left')
-    plt.savefig('dividend_ontwikkeling.png', bbox_inches='tight', dpi=100)
+    image = BytesIO()
+    plt.savefig(image, format='png', bbox_inches='tight', dpi=100)
     plt.close()
 
+    return image.getvalue()
+
+
+def add_dividend_chart(wb, ws, totals: pd.DataFrame, start_row: int, chart_row: int):
+    """
+    Add native Excel bar chart with quarterly dividends. The chart references the table on the sheet, i.e. a header
+    row at start_row followed by a row per quarter with the dividend per currency.
+
+    :param wb: xlsxwriter Workbook object.
+    :param ws: xlsxwriter Worksheet object.
+    :param totals: dataframe with dividends as written to the sheet.
+    :param start_row: Integer row of the table header.
+    :param chart_row: Integer row to insert the chart at.
+    """
+
+    sheet_name = ws.get_name()
+    first_row, last_row = start_row + 1, start_row + len(totals.index)
+
+    chart = wb.add_chart({'type': 'column'})
+    for i, col in enumerate(totals.columns):
+        chart.add_series({
+            'name': [sheet_name, start_row, i + 1],
+            'categories': [sheet_name, first_row, 0, last_row, 0],
+            'values': [sheet_name, first_row, i + 1, last_row, i + 1],
+            'fill': {'color': dividend_colors[i % len(dividend_colors)]}
+        })
+
+    chart.set_title({'name': 'Dividend overview'})
+    chart.set_x_axis({'num_font': {'rotation': -90}})
+    chart.set_y_axis({'name': 'Dividend'})
+    chart.set_legend({'position': 'overlay_top_left'})
+    ws.insert_chart(chart_row, 5, chart)
+
 
-def write_dividend_overview(writer: pd.ExcelWriter, wb) -> pd.ExcelWriter:
+def write_dividend_overview(writer: pd.ExcelWriter, wb, formats: dict, native_charts: bool = False) -> pd.ExcelWriter:
     """
     Write dividend overview to separate sheets. This creates two tables and a stacked barplot.
 
     :param writer: Exelwriter object.
     :param wb: Excelwriter workbook.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
+    :param native_charts: add a native Excel chart instead of a matplotlib image.
     :return overview of deposits over time.
     """
     sheet_name = 'Dividends'
@@ -456,7 +707,7 @@ def write_dividend_overview(writer: pd.ExcelWriter, wb) -> pd.ExcelWriter:
     total_overview = dividends.groupby(['Quarter', 'Mutatie']).sum(['Dividend']).reset_index()
     wide_totals = total_overview.pivot(index='Quarter', columns='Mutatie')
     wide_totals.columns = [col[-1] for col in wide_totals.columns.values]
-    plot_total_dividend(wide_totals)
+    quarterly = wide_totals.set_axis(wide_totals.index.astype(str), axis=0)  # quarters as labels, e.g. 2020Q1
     wide_totals['zzzTotal'] = wide_totals.sum(axis=1)  # zzz added for sorting later
     wide_totals = wide_totals.reset_index()
 
@@ -467,25 +718,32 @@ def write_dividend_overview(writer: pd.ExcelWriter, wb) -> pd.ExcelWriter:
     year_view = year_view.swaplevel(axis=1).sort_index(axis=1)
     year_view['FY', 'Total'] = list(wide_totals.groupby('Year')['zzzTotal'].sum())
     year_view = year_view.rename(columns={'zzzTotal': 'Total'})
-    year_view.to_excel(writer, sheet_name=sheet_name)
+    write_frame(writer, formats, year_view, sheet_name)
 
     div_per_company = dividends.groupby('Product')['Dividend'].sum().sort_values(ascending=False)
-    div_per_company.to_excel(writer, startrow=len(year_view)+6, sheet_name=sheet_name)
+    write_frame(writer, formats, div_per_company.to_frame(), sheet_name, startrow=len(year_view)+6)
 
     ws = wb.get_worksheet_by_name(sheet_name)
-    ws.insert_image(len(year_view)+6, 5, 'dividend_ontwikkeling.png')
+    if native_charts:
+        # the chart data goes below the dividends per company
+        dividend_row = len(year_view) + len(div_per_company) + 9
+        write_frame(writer, formats, quarterly, sheet_name, startrow=dividend_row)
+        add_dividend_chart(wb, ws, quarterly, dividend_row, len(year_view)+6)
+    else:
+        insert_plots([(ws, len(year_view)+6, 5, 'dividend_ontwikkeling.png', plot_total_dividend, (quarterly, ))])
     ws.set_column(0, 0, 30)
     ws.set_column(1, len(year_view.columns), 10)
 
     return writer
 
 
-def write_costs_overview(writer: pd.ExcelWriter, wb) -> pd.ExcelWriter:
+def write_costs_overview(writer: pd.ExcelWriter, wb, formats: dict) -> pd.ExcelWriter:
     """
     Write cost overview to separate sheet. This creates a table.
 
     :param writer: Exelwriter object.
     :param wb: Excelwriter workbook.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
     :return overview of costs over time.
     """
     sheet_name = 'Costs'
@@ -500,7 +758,7 @@ def write_costs_overview(writer: pd.ExcelWriter, wb) -> pd.ExcelWriter:
     wide_totals.columns = [col[-1] for col in wide_totals.columns.values]
     wide_totals['Total'] = wide_totals.sum(axis=1)
     wide_totals = wide_totals.reset_index()
-    wide_totals.to_excel(writer, sheet_name=sheet_name, index=False)
+    write_frame(writer, formats, wide_totals, sheet_name, index=False)
     ws = wb.get_worksheet_by_name(sheet_name)
     ws.set_column(1, len(wide_totals.columns) - 1, 20)
 
@@ -508,8 +766,8 @@ def write_costs_overview(writer: pd.ExcelWriter, wb) -> pd.ExcelWriter:
 
 
 def write_returns_overview(
-        totals_dict: dict, totals_waarde_full: list, deposits: pd.DataFrame, benchmark: pd.DataFrame,
-        writer: pd.ExcelWriter, wb
+        totals_dict: dict, totals_waarde_full: list, simulation: BenchmarkSimulation, writer: pd.ExcelWriter, wb,
+        formats: dict, native_charts: bool = False
 ) -> pd.ExcelWriter:
     """
     Write yearly returns overview to separate sheet. This creates a table. The yearly return is calculated by
@@ -517,10 +775,11 @@ def write_returns_overview(
 
     :param totals_dict: dictionary with totals per year to calculate returns.
     :param totals_waarde_full: list with portfolio value over time.
-    :param deposits: Dataframe with deposits made.
-    :param benchmark: Dataframe with benchmark pricing data.
+    :param simulation: BenchmarkSimulation with the deposits invested in the benchmarks.
     :param writer: Exelwriter object.
     :param wb: Excelwriter workbook.
+    :param formats: Dict with the cell formats of the workbook, from add_formats.
+    :param native_charts: add a native Excel chart instead of a matplotlib image.
     :return overview of costs over time.
     """
 
@@ -557,11 +816,17 @@ def write_returns_overview(
         }))
 
     returns_overview['Winst/verliest (cumulatief)'] = returns_overview['Winst/verlies'].cumsum()
-    returns_overview.to_excel(writer, sheet_name=sheet_name, index=False)
+    write_frame(writer, formats, returns_overview, sheet_name, index=False)
     ws = wb.get_worksheet_by_name(sheet_name)
     ws.set_column(1, len(returns_overview.columns), 20)
 
     totals_waarde_full = pd.concat(totals_waarde_full).reset_index(drop=True)
-    add_jaaroverzicht_plot(ws, totals_waarde_full, deposits, benchmark, start_row=len(returns_overview)+3, year='')
+    if native_charts:
+        # write the portefeuille development over all years below the returns, for the chart to reference
+        table = simulation.simulate(totals_waarde_full).rename(columns={'index': 'Datum'})
+        write_frame(writer, formats, table, sheet_name, startrow=len(returns_overview)+5, index=False)
+        add_jaaroverzicht_chart(wb, ws, table, start_row=len(returns_overview)+5, year='')
+    else:
+        add_jaaroverzicht_plot(ws, totals_waarde_full, simulation, start_row=len(returns_overview)+3, year='')
 
     return writer